@@ -0,0 +1,185 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+from metrics import registry, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+class Busy(Exception):
+    """Raised when a turn is refused; clients should retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Server busy ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": "busy",
+            "reason": self.reason,
+            "retry_after": round(self.retry_after, 2)
+        }
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> Optional[float]:
+        """Take a token; returns None if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+class AdmissionController:
+    """Per-client rate limits plus a global budget of concurrent generations.
+
+    Each connection (and each verified user, see identity.py) gets a
+    token bucket per lane: image frames from a camera stream arrive far
+    faster than chat messages and must not use up the chat budget. Admitted turns then wait for one of `max_concurrency`
+    generation slots; once `max_queue` turns are waiting, or a turn waits
+    longer than `max_wait`, it is refused with a Busy whose retry-after is
+    estimated from how long slots are currently held.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0.5,
+        burst: float = 5,
+        image_rate: float = 2,
+        image_burst: float = 10,
+        max_concurrency: int = 64,
+        max_queue: int = 128,
+        max_wait: float = 10,
+        max_clients: int = 10000
+    ):
+        self.rate = rate
+        self.burst = burst
+        # (rate, burst) per lane; unknown lanes share the chat limits
+        self.limits = {'chat': (rate, burst), 'image': (image_rate, image_burst)}
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_clients = max_clients
+
+        self._buckets: 'OrderedDict[str, TokenBucket]' = OrderedDict()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.active = 0
+        # Moving average of how long a generation holds its slot
+        self.hold_time = 1.0
+
+        self.admitted = 0
+        self.rate_limited = 0
+        self.overloaded = 0
+
+    def _bucket(self, key: str, lane: str) -> TokenBucket:
+        key = f"{lane}:{key}"
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.limits.get(lane, self.limits['chat']))
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def check_rate(
+        self,
+        connection_id: str,
+        user_id: Optional[str] = None,
+        lane: str = 'chat'
+    ) -> Optional[Busy]:
+        """The Busy to send if the connection or user is sending too fast, else None.
+
+        Checked on every incoming turn, so refusals are returned, not raised.
+        `user_id` must be verified: one a client states could drain another
+        user's bucket, and leaving it out would skip the user limit.
+        """
+        keys: List[str] = [connection_id]
+        if user_id:
+            keys.append(f"user:{user_id}")
+
+        waits = [wait for wait in (self._bucket(key, lane).take() for key in keys) if wait is not None]
+        if waits:
+            self.rate_limited += 1
+            ADMISSION_REJECTIONS.inc(reason='rate_limited')
+            return Busy('rate_limited', max(waits))
+        return None
+
+    def forget(self, connection_id: str):
+        for lane in self.limits:
+            self._buckets.pop(f"{lane}:{connection_id}", None)
+
+    def retry_after(self) -> float:
+        # Roughly when a slot frees up for everyone already queued
+        return max(1.0, self.hold_time * (self.waiting + 1) / self.max_concurrency)
+
+    def _reject(self) -> Busy:
+        self.overloaded += 1
+        ADMISSION_REJECTIONS.inc(reason='overloaded')
+        return Busy('overloaded', self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold one of the global generation slots, waiting at most `max_wait`."""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise self._reject()
+
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            raise self._reject()
+        finally:
+            self.waiting -= 1
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start)
+
+        self.admitted += 1
+        self.active += 1
+        held = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            self.hold_time = 0.9 * self.hold_time + 0.1 * (time.monotonic() - held)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "overloaded": self.overloaded,
+            "retry_after": round(self.retry_after(), 2)
+        }
+
+def create_admission_controller() -> AdmissionController:
+    """Build admission control from the RATE_LIMIT_* and ADMISSION_* variables."""
+    controller = AdmissionController(
+        rate=float(os.getenv('RATE_LIMIT_PER_MINUTE', '30')) / 60,
+        burst=float(os.getenv('RATE_LIMIT_BURST', '5')),
+        image_rate=float(os.getenv('IMAGE_RATE_LIMIT_PER_MINUTE', '120')) / 60,
+        image_burst=float(os.getenv('IMAGE_RATE_LIMIT_BURST', '10')),
+        max_concurrency=int(os.getenv('ADMISSION_MAX_CONCURRENCY', '64')),
+        max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', '128')),
+        max_wait=float(os.getenv('ADMISSION_MAX_WAIT', '10'))
+    )
+    registry.gauge(
+        'senti_admission_waiting',
+        'Turns queued for a generation slot.',
+        lambda: controller.waiting
+    )
+    return controller
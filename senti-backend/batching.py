@@ -0,0 +1,144 @@
+import os
+import json
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+
+from llm_providers import BaseLLMProvider
+
+logger = logging.getLogger(__name__)
+
+Request = Tuple[str, Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]
+
+class BatchingProvider(BaseLLMProvider):
+    """Collects concurrent calls to a local backend into short batching windows.
+
+    Each window is flushed after `window` seconds or once `max_batch` calls
+    are waiting. Identical requests in a window share a single upstream
+    call, and the distinct ones are pipelined with at most
+    `max_concurrency` requests in flight, so a single inference box isn't
+    handed more parallel work than it can serve.
+    """
+
+    def __init__(
+        self,
+        provider: BaseLLMProvider,
+        window: float = 0.015,
+        max_batch: int = 8,
+        max_concurrency: int = 4
+    ):
+        self.provider = provider
+        self.window = window
+        self.max_batch = max_batch
+        self.model = getattr(provider, 'model', '')
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending: List[Tuple[str, Request, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+        self.batches = 0
+        self.requests = 0
+        self.coalesced = 0
+
+    async def generate_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request = (text, session_memory, sentiment)
+        key = json.dumps(request, sort_keys=True, default=str)
+        self._pending.append((key, request, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches += 1
+
+        # Fan identical requests out from one upstream call
+        groups: Dict[str, Tuple[Request, List[asyncio.Future]]] = {}
+        for key, request, future in batch:
+            groups.setdefault(key, (request, []))[1].append(future)
+        self.coalesced += len(batch) - len(groups)
+
+        for request, futures in groups.values():
+            task = asyncio.create_task(self._run(request, futures))
+            # Hold a reference until done so the task isn't garbage collected
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+            # Once every caller has given up (cancelled turn, router timeout),
+            # stop the upstream call so it doesn't keep holding a slot
+            def abandon(_, task=task, futures=futures):
+                if all(future.cancelled() for future in futures):
+                    task.cancel()
+            for future in futures:
+                future.add_done_callback(abandon)
+
+    async def _run(self, request: Request, futures: List[asyncio.Future]):
+        # Skip work nobody is waiting for any more (e.g. timed out upstream)
+        if all(future.done() for future in futures):
+            return
+
+        try:
+            async with self._semaphore:
+                result = await self.provider.generate_response(*request)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in futures:
+                if not future.done():
+                    future.set_result(result)
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        # Streams can't be shared, but still count against the backend's concurrency
+        async with self._semaphore:
+            async for chunk in self.provider.stream_response(text, session_memory, sentiment):
+                yield chunk
+
+    async def analyze_image(self, image_base64: str) -> str:
+        async with self._semaphore:
+            return await self.provider.analyze_image(image_base64)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "avg_batch_size": self.requests / self.batches if self.batches else 0.0
+        }
+
+def create_batching_provider(provider: BaseLLMProvider) -> BaseLLMProvider:
+    """Wrap a local backend in a BatchingProvider when LOCAL_BATCHING is enabled."""
+    if os.getenv('LOCAL_BATCHING', 'false').lower() != 'true':
+        return provider
+
+    return BatchingProvider(
+        provider,
+        window=float(os.getenv('LOCAL_BATCH_WINDOW_MS', '15')) / 1000,
+        max_batch=int(os.getenv('LOCAL_BATCH_MAX', '8')),
+        max_concurrency=int(os.getenv('LOCAL_BATCH_CONCURRENCY', '4'))
+    )
@@ -0,0 +1,529 @@
+"""Load-test and latency benchmark for the Senti websocket backends.
+
+Starts the gateway in a subprocess with every provider replaced by a
+FakeProvider (configurable latency and token rate), drives N concurrent
+websocket clients through scripted conversations and reports
+throughput, time-to-first-token, latency percentiles and server memory per
+connection. Results are saved as JSON so builds can be compared:
+
+    python benchmark.py run --clients 200 --turns 5 --output before.json
+    python benchmark.py run --clients 200 --turns 5 --compare before.json
+
+`startup` measures cold import time and peak memory of an app in fresh
+interpreters, e.g. for a single-provider deployment:
+
+    python benchmark.py startup --app main --providers ollama
+
+`sentiment` compares batch sentiment scoring against scoring each text
+with TextBlob, on the scripted turns or on messages from a JSONL export:
+
+    python benchmark.py sentiment --input transcripts.jsonl --texts 100000
+
+`archive` measures appends to, and tail reads from, a user's on-disk
+conversation log, as used to restore long-term memory on reconnect:
+
+    python benchmark.py archive --turns 20000 --tail 20
+
+`memory` measures recall from a user's long-term memory index, exact
+and partitioned, on the scripted turns or messages from a JSONL export:
+
+    python benchmark.py memory --input transcripts.jsonl --texts 50000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+SCRIPT = [
+    "Hi Senti, how are you today?",
+    "I've been feeling a bit lonely lately.",
+    "Work has been stressful and I don't sleep well.",
+    "Thanks for listening, that actually helps.",
+    "What could I do this weekend to feel better?",
+]
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def _rss_kb(pid: int) -> Optional[int]:
+    """Resident set size of a process from /proc (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def serve(args):
+    """Run the selected app with fake providers (used as the benchmark subprocess)."""
+    import uvicorn
+    from llm_providers import BaseLLMProvider
+
+    class FakeProvider(BaseLLMProvider):
+        """Stand-in upstream with a fixed first-token latency and token rate."""
+
+        def __init__(self, latency: float, tokens_per_second: float, tokens: int):
+            self.latency = latency
+            self.interval = 1.0 / tokens_per_second
+            self.tokens = tokens
+            self.model = 'fake'
+
+        async def stream_response(self, text, session_memory=None, sentiment=None) -> AsyncIterator[str]:
+            await asyncio.sleep(self.latency)
+            for i in range(self.tokens):
+                if i:
+                    await asyncio.sleep(self.interval)
+                yield f"tok{i} "
+
+        async def generate_response(self, text, session_memory=None, sentiment=None) -> str:
+            return ''.join([chunk async for chunk in self.stream_response(text, session_memory, sentiment)])
+
+        async def analyze_image(self, image_base64: str) -> str:
+            await asyncio.sleep(self.latency)
+            return "A fake image description."
+
+    # Every turn should reach the (fake) upstream, and scripted clients send
+    # turns back to back, faster than the per-client rate limit allows
+    os.environ.setdefault('RESPONSE_CACHE_MAX_ENTRIES', '0')
+    os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '100000')
+    os.environ.setdefault('RATE_LIMIT_BURST', '1000')
+    os.environ.setdefault('IMAGE_RATE_LIMIT_PER_MINUTE', '100000')
+    os.environ.setdefault('IMAGE_RATE_LIMIT_BURST', '1000')
+
+    import gateway
+
+    router = gateway.provider_router
+    for name in list(router.providers):
+        router.providers[name] = FakeProvider(args.latency, args.tokens_per_second, args.tokens)
+
+    uvicorn.run(gateway.app, host='127.0.0.1', port=args.port, log_level='warning')
+
+async def _wait_for_server(port: int, timeout: float = 30):
+    import aiohttp
+
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f'http://127.0.0.1:{port}/health') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+def _turn_payload(app: str, text: str) -> Dict[str, Any]:
+    if app == 'main':
+        return {"type": "chat_message", "message": text, "model": "gemini", "stream": True}
+    return {"message": text, "provider": "gemini", "stream": True}
+
+async def _client(app: str, url: str, turns: int, connected: asyncio.Event, go: asyncio.Event, results: Dict[str, Any]):
+    import websockets
+
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            json.loads(await ws.recv())  # session frame
+            connected.set()
+            await go.wait()
+
+            for i in range(turns):
+                start = time.perf_counter()
+                await ws.send(json.dumps(_turn_payload(app, SCRIPT[i % len(SCRIPT)])))
+                first = None
+                while True:
+                    frame = json.loads(await ws.recv())
+                    if frame.get('type') == 'error':
+                        raise RuntimeError(frame.get('error') or frame.get('content'))
+                    if frame.get('type') == 'busy':
+                        raise RuntimeError(f"busy ({frame.get('reason')})")
+                    if frame.get('type') != 'stream':
+                        continue
+                    if first is None:
+                        first = time.perf_counter() - start
+                    if frame.get('done'):
+                        break
+
+                results['ttft'].append(first)
+                results['latency'].append(time.perf_counter() - start)
+    except Exception as e:
+        connected.set()
+        results['errors'].append(str(e))
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    port = args.port
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve',
+         '--app', args.app, '--port', str(port),
+         '--latency', str(args.latency),
+         '--tokens-per-second', str(args.tokens_per_second),
+         '--tokens', str(args.tokens)],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    try:
+        await _wait_for_server(port)
+        idle_rss = _rss_kb(server.pid)
+
+        path = '/' if args.app == 'main' else '/ai'
+        url = f'ws://127.0.0.1:{port}{path}'
+        results: Dict[str, Any] = {"ttft": [], "latency": [], "errors": []}
+        go = asyncio.Event()
+        events = []
+        tasks = []
+        for _ in range(args.clients):
+            connected = asyncio.Event()
+            events.append(connected)
+            tasks.append(asyncio.create_task(_client(app=args.app, url=url, turns=args.turns, connected=connected, go=go, results=results)))
+        await asyncio.gather(*[event.wait() for event in events])
+
+        # Memory is sampled with every client connected but idle
+        connected_rss = _rss_kb(server.pid)
+
+        start = time.perf_counter()
+        go.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    turns = len(results['latency'])
+    memory_per_connection = None
+    if idle_rss is not None and connected_rss is not None and args.clients:
+        memory_per_connection = (connected_rss - idle_rss) / args.clients
+
+    return {
+        "app": args.app,
+        "git_rev": _git_rev(),
+        "timestamp": time.time(),
+        "config": {
+            "clients": args.clients,
+            "turns": args.turns,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "tokens": args.tokens
+        },
+        "turns_completed": turns,
+        "errors": len(results['errors']),
+        "elapsed_s": elapsed,
+        "throughput_turns_per_s": turns / elapsed if elapsed else 0.0,
+        "ttft_s": {f"p{p}": percentile(results['ttft'], p) for p in (50, 95, 99)},
+        "latency_s": {f"p{p}": percentile(results['latency'], p) for p in (50, 95, 99)},
+        "server_rss_kb": {"idle": idle_rss, "connected": connected_rss},
+        "memory_per_connection_kb": memory_per_connection
+    }
+
+def measure_startup(args) -> Dict[str, Any]:
+    """Cold import time and peak RSS of an app, each run in a fresh interpreter."""
+    code = (
+        "import time, resource; start = time.perf_counter(); "
+        f"import {args.app}; "
+        "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    )
+    env = dict(os.environ)
+    if args.providers:
+        env['ENABLED_PROVIDERS'] = args.providers
+
+    times, rss = [], []
+    for _ in range(args.repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-W', 'ignore', '-c', code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            stderr=subprocess.DEVNULL
+        ).decode().split()
+        times.append(float(output[0]))
+        rss.append(int(output[1]))
+
+    return {
+        "app": args.app,
+        "providers": args.providers or env.get('ENABLED_PROVIDERS', 'all'),
+        "import_s": {"min": min(times), "p50": percentile(times, 50)},
+        "peak_rss_kb": percentile(rss, 50)
+    }
+
+def _sentiment_corpus(args) -> List[str]:
+    if not args.input:
+        # Distinct texts, so nothing is answered from a cache
+        return [f"{line} {i}" for i in range(args.texts // len(SCRIPT) + 1) for line in SCRIPT][:args.texts]
+
+    texts = []
+    with open(args.input) as f:
+        for line in f:
+            if len(texts) >= args.texts:
+                break
+            try:
+                text = json.loads(line).get(args.text_field)
+            except (ValueError, AttributeError):
+                continue
+            if isinstance(text, str):
+                texts.append(text)
+    return texts
+
+def measure_sentiment(args) -> Dict[str, Any]:
+    """Throughput and agreement of batch scoring versus TextBlob one text at a time."""
+    from sentiment_analyzer import score_text, label_for, compiled_lexicon
+
+    texts = _sentiment_corpus(args)
+    lexicon = compiled_lexicon()
+    if lexicon is None:
+        raise SystemExit("The compiled lexicon is disabled (SENTIMENT_ENGINE) or numpy is missing")
+
+    start = time.perf_counter()
+    expected = [score_text(text) for text in texts]
+    textblob_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = []
+    for i in range(0, len(texts), args.batch_size):
+        scores.extend(lexicon.score(texts[i:i + args.batch_size]))
+    lexicon_s = time.perf_counter() - start
+
+    return {
+        "texts": len(texts),
+        "textblob_texts_per_s": len(texts) / textblob_s,
+        "lexicon_texts_per_s": len(texts) / lexicon_s,
+        "speedup": textblob_s / lexicon_s,
+        "label_agreement": sum(
+            label_for(polarity) == score['label'] for (polarity, _), score in zip(scores, expected)
+        ) / max(len(texts), 1),
+        "max_polarity_diff": max(
+            (abs(polarity - score['polarity']) for (polarity, _), score in zip(scores, expected)), default=0.0
+        ),
+        "paths": lexicon.stats()
+    }
+
+def measure_archive(args) -> Dict[str, Any]:
+    """Append and tail-read latency of one user's conversation log in a scratch directory."""
+    import tempfile
+    from conversation_log import UserLog
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = UserLog(os.path.join(directory, 'user'), max_turns=args.max_turns)
+        appends = []
+        for i in range(args.turns // 2):
+            turns = [
+                {"role": "user", "content": f"{SCRIPT[i % len(SCRIPT)]} {i}"},
+                {"role": "assistant", "content": f"I hear you. {SCRIPT[(i + 1) % len(SCRIPT)]}"}
+            ]
+            start = time.perf_counter()
+            log.append(turns)
+            appends.append(time.perf_counter() - start)
+
+        tails = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            log.tail(args.tail)
+            tails.append(time.perf_counter() - start)
+
+        # A cold open includes recovery checks and mapping the files
+        log.close()
+        start = time.perf_counter()
+        UserLog(os.path.join(directory, 'user'), max_turns=args.max_turns).tail(args.tail)
+        cold_tail = time.perf_counter() - start
+
+        return {
+            "turns": len(log),
+            "log_bytes": os.path.getsize(log.log_path),
+            "append_s": {"p50": percentile(appends, 50), "p99": percentile(appends, 99), "max": max(appends)},
+            "tail_s": {"p50": percentile(tails, 50), "p99": percentile(tails, 99)},
+            "cold_tail_s": cold_tail
+        }
+
+def measure_memory(args) -> Dict[str, Any]:
+    """Add and search latency of one user's memory index, and how often partitioned search agrees with exact."""
+    import random
+    import tempfile
+    from memory_index import HashingEmbedder, UserMemory
+
+    texts = _sentiment_corpus(args)
+    rng = random.Random(0)
+    queries = [rng.choice(texts) for _ in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        embedder = HashingEmbedder(args.dim)
+        memory = UserMemory(os.path.join(directory, 'user'), embedder, args.ivf_threshold, args.nprobe)
+        start = time.perf_counter()
+        for i in range(0, len(texts), args.batch_size):
+            memory.add([{"user": text, "assistant": ""} for text in texts[i:i + args.batch_size]])
+        add_s = time.perf_counter() - start
+
+        vectors = embedder.embed(queries)
+        results = {}
+        for name, threshold in (('exact', len(texts) + 1), ('partitioned', args.ivf_threshold)):
+            memory.ivf_threshold = threshold
+            memory.search(vectors[0], args.top_k)  # maps the matrix and partitions it
+            latencies, scores = [], []
+            for vector in vectors:
+                start = time.perf_counter()
+                found = memory.search(vector, args.top_k)
+                latencies.append(time.perf_counter() - start)
+                scores.append(found[0][0] if found else 0.0)
+            results[name] = (latencies, scores)
+        memory.close()
+
+    exact_latency, exact_scores = results['exact']
+    ivf_latency, ivf_scores = results['partitioned']
+    return {
+        "memories": len(texts),
+        "add_per_memory_s": add_s / max(len(texts), 1),
+        "exact_search_s": {"p50": percentile(exact_latency, 50), "p99": percentile(exact_latency, 99)},
+        "partitioned_search_s": {"p50": percentile(ivf_latency, 50), "p99": percentile(ivf_latency, 99)},
+        "partitioned": len(texts) >= args.ivf_threshold,
+        "top1_agreement": sum(
+            found >= best - 1e-6 for found, best in zip(ivf_scores, exact_scores)
+        ) / max(len(queries), 1)
+    }
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _fmt(value: Optional[float], scale: float = 1000, unit: str = 'ms') -> str:
+    return '-' if value is None else f"{value * scale:.1f}{unit}"
+
+def report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    rows = [
+        ("throughput", result['throughput_turns_per_s'], 'turns/s'),
+        ("ttft p50", result['ttft_s']['p50'], 's'),
+        ("ttft p95", result['ttft_s']['p95'], 's'),
+        ("ttft p99", result['ttft_s']['p99'], 's'),
+        ("latency p50", result['latency_s']['p50'], 's'),
+        ("latency p95", result['latency_s']['p95'], 's'),
+        ("latency p99", result['latency_s']['p99'], 's'),
+        ("memory/conn", result['memory_per_connection_kb'], 'KB'),
+    ]
+    base = {}
+    if baseline:
+        base = {
+            "throughput": baseline['throughput_turns_per_s'],
+            "memory/conn": baseline['memory_per_connection_kb'],
+            **{f"ttft {k}": v for k, v in baseline['ttft_s'].items()},
+            **{f"latency {k}": v for k, v in baseline['latency_s'].items()},
+        }
+
+    print(f"{result['app']} @ {result['git_rev']}: {result['turns_completed']} turns, "
+          f"{result['errors']} errors in {result['elapsed_s']:.2f}s")
+    for name, value, unit in rows:
+        if unit == 's':
+            line = f"  {name:<12} {_fmt(value):>10}"
+        else:
+            line = f"  {name:<12} {_fmt(value, 1, ' ' + unit):>14}"
+        previous = base.get(name)
+        if value is not None and previous:
+            line += f"   ({(value - previous) / previous * 100:+.1f}% vs baseline)"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    startup = sub.add_parser('startup')
+    startup.add_argument('--app', choices=['main', 'api_service'], default='main')
+    startup.add_argument('--providers', help='ENABLED_PROVIDERS for the measured app')
+    startup.add_argument('--repeat', type=int, default=5)
+
+    sentiment = sub.add_parser('sentiment')
+    sentiment.add_argument('--input', help='JSONL export to take texts from (default: scripted turns)')
+    sentiment.add_argument('--text-field', default='message')
+    sentiment.add_argument('--texts', type=int, default=20000)
+    sentiment.add_argument('--batch-size', type=int, default=64)
+
+    archive = sub.add_parser('archive')
+    archive.add_argument('--turns', type=int, default=20000, help='turns to append')
+    archive.add_argument('--tail', type=int, default=20, help='turns per tail read')
+    archive.add_argument('--max-turns', type=int, default=10000, help='retention before compaction')
+    archive.add_argument('--repeat', type=int, default=1000)
+
+    memory = sub.add_parser('memory')
+    memory.add_argument('--input', help='JSONL export to take texts from (default: scripted turns)')
+    memory.add_argument('--text-field', default='message')
+    memory.add_argument('--texts', type=int, default=20000, help='memories to index')
+    memory.add_argument('--queries', type=int, default=500)
+    memory.add_argument('--batch-size', type=int, default=500, help='memories per add')
+    memory.add_argument('--dim', type=int, default=256)
+    memory.add_argument('--top-k', type=int, default=3)
+    memory.add_argument('--ivf-threshold', type=int, default=10000)
+    memory.add_argument('--nprobe', type=int, default=16)
+
+    for name in ('run', 'serve'):
+        cmd = sub.add_parser(name)
+        cmd.add_argument(
+            '--app', choices=['main', 'api_service'], default='main',
+            help='client dialect: chat_message frames on / (main) or untyped frames on /ai (api_service)'
+        )
+        cmd.add_argument('--port', type=int, default=8799)
+        cmd.add_argument('--latency', type=float, default=0.3, help='fake first-token latency (s)')
+        cmd.add_argument('--tokens-per-second', type=float, default=50)
+        cmd.add_argument('--tokens', type=int, default=40, help='tokens per fake response')
+        if name == 'run':
+            cmd.add_argument('--clients', type=int, default=50)
+            cmd.add_argument('--turns', type=int, default=3)
+            cmd.add_argument('--output', help='save results as JSON')
+            cmd.add_argument('--compare', help='baseline JSON to compare against')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+        return
+    if args.command == 'startup':
+        result = measure_startup(args)
+        print(f"{result['app']} ({result['providers']}): import "
+              f"{_fmt(result['import_s']['min'])} min, {_fmt(result['import_s']['p50'])} p50, "
+              f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MB")
+        return
+    if args.command == 'sentiment':
+        result = measure_sentiment(args)
+        print(f"{result['texts']} texts: TextBlob {result['textblob_texts_per_s']:.0f}/s, "
+              f"lexicon {result['lexicon_texts_per_s']:.0f}/s ({result['speedup']:.1f}x)")
+        print(f"  labels agree {result['label_agreement'] * 100:.2f}%, "
+              f"max polarity diff {result['max_polarity_diff']:.2g}, paths {result['paths']}")
+        return
+
+    if args.command == 'archive':
+        result = measure_archive(args)
+        print(f"{result['turns']} turns ({result['log_bytes'] / 1024:.0f} KB): append "
+              f"{_fmt(result['append_s']['p50'], 1e6, 'us')} p50, {_fmt(result['append_s']['p99'], 1e6, 'us')} p99, "
+              f"{_fmt(result['append_s']['max'])} max")
+        print(f"  tail {args.tail}: {_fmt(result['tail_s']['p50'], 1e6, 'us')} p50, "
+              f"{_fmt(result['tail_s']['p99'], 1e6, 'us')} p99, cold {_fmt(result['cold_tail_s'], 1e6, 'us')}")
+        return
+
+    if args.command == 'memory':
+        result = measure_memory(args)
+        print(f"{result['memories']} memories: add {_fmt(result['add_per_memory_s'], 1e6, 'us')} each, "
+              f"exact search {_fmt(result['exact_search_s']['p50'], 1e6, 'us')} p50")
+        if result['partitioned']:
+            print(f"  partitioned search {_fmt(result['partitioned_search_s']['p50'], 1e6, 'us')} p50, "
+                  f"top-1 agreement {result['top1_agreement'] * 100:.1f}%")
+        return
+
+    result = asyncio.run(run_benchmark(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    main()
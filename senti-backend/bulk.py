@@ -0,0 +1,277 @@
+"""Offline bulk processing of exported conversation logs.
+
+Streams a JSONL file one record per line, adds sentiment scores (computed
+in a process pool) and optionally a freshly generated reply, and writes the
+enriched records as JSONL in input order. Memory stays constant: only
+`window` batches are in flight at once. Progress is checkpointed next to
+the output, so an interrupted run picks up where it stopped:
+
+    python bulk.py transcripts.jsonl scored.jsonl --provider ollama --concurrency 16
+    python bulk.py transcripts.jsonl scored.jsonl --no-replies --workers 8
+
+Each input line is a JSON object whose `message` is the text to process; an
+optional `history` list of {role, content} turns is passed to the provider
+as session memory. Lines that can't be processed are written with an
+`error` field instead of stopping the run.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from collections import deque
+from typing import List, Dict, Any, Optional, AsyncIterator, Iterable, Iterator, Tuple
+
+from llm_providers import BaseLLMProvider
+from sentiment_service import SentimentService
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, Any]
+
+# Log progress every this many batches
+PROGRESS_EVERY = 100
+
+def _load_checkpoint(path: str) -> Dict[str, int]:
+    try:
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+    except FileNotFoundError:
+        return {"input_offset": 0, "output_offset": 0, "lines": 0}
+
+def _save_checkpoint(path: str, state: Dict[str, int]):
+    # Replace atomically so a crash never leaves a torn checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as checkpoint:
+        json.dump(state, checkpoint)
+    os.replace(tmp_path, path)
+
+def _read_batches(
+    input_file,
+    batch_size: int,
+    offset: int,
+    line_number: int
+) -> Iterator[Tuple[Tuple[int, int], List[Record]]]:
+    """Batches of parsed records, each tagged with the input position after it."""
+    batch: List[Record] = []
+    for raw in input_file:
+        offset += len(raw)
+        line_number += 1
+        if raw.strip():
+            try:
+                record = json.loads(raw)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                record = {"line": line_number, "error": f"Invalid record: {e}"}
+            batch.append(record)
+
+        if len(batch) >= batch_size:
+            yield (offset, line_number), batch
+            batch = []
+    if batch:
+        yield (offset, line_number), batch
+
+class BulkProcessor:
+    """Sentiment scoring and reply generation for batches of records.
+
+    Batches are processed concurrently (at most `window` at a time) but
+    handed back in input order. Sentiment for a batch is one call into the
+    worker pool; replies are generated with at most `concurrency` provider
+    calls in flight across all batches.
+    """
+
+    def __init__(
+        self,
+        sentiment: Optional[SentimentService] = None,
+        provider: Optional[BaseLLMProvider] = None,
+        concurrency: int = 8,
+        batch_size: int = 64,
+        window: int = 4,
+        text_field: str = 'message',
+        history_field: str = 'history'
+    ):
+        self.sentiment = sentiment
+        self.provider = provider
+        self.batch_size = batch_size
+        self.window = max(1, window)
+        self.text_field = text_field
+        self.history_field = history_field
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+        self.processed = 0
+        self.errors = 0
+
+    async def _reply(self, record: Record):
+        text = record.get(self.text_field)
+        if not text:
+            record['error'] = f"Missing {self.text_field}"
+            return
+
+        async with self._semaphore:
+            try:
+                record['response'] = await self.provider.generate_response(
+                    text=text,
+                    session_memory=record.get(self.history_field),
+                    sentiment=record.get('sentiment')
+                )
+            except Exception as e:
+                record['error'] = str(e)
+
+    async def _process_batch(self, batch: List[Record]) -> List[Record]:
+        # Records that failed to parse pass straight through
+        valid = [record for record in batch if 'error' not in record]
+
+        if self.sentiment is not None and valid:
+            texts = [str(record.get(self.text_field) or '') for record in valid]
+            for record, score in zip(valid, await self.sentiment.analyze_batch(texts)):
+                record['sentiment'] = score
+
+        if self.provider is not None:
+            await asyncio.gather(*[self._reply(record) for record in valid])
+
+        self.processed += len(batch)
+        self.errors += sum(1 for record in batch if 'error' in record)
+        return batch
+
+    async def _ordered(self, batches: Iterable[Tuple[Any, List[Record]]]) -> AsyncIterator[Tuple[Any, List[Record]]]:
+        """Process tagged batches concurrently, yielding them back in order."""
+        pending: 'deque[Tuple[Any, asyncio.Task]]' = deque()
+        try:
+            for tag, batch in batches:
+                pending.append((tag, asyncio.create_task(self._process_batch(batch))))
+                if len(pending) >= self.window:
+                    tag, task = pending.popleft()
+                    yield tag, await task
+            while pending:
+                tag, task = pending.popleft()
+                yield tag, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def process(self, records: Iterable[Record]) -> AsyncIterator[Record]:
+        """Enrich a stream of records, yielding them in order (library entry point)."""
+        def batches():
+            batch: List[Record] = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    yield None, batch
+                    batch = []
+            if batch:
+                yield None, batch
+
+        async for _, batch in self._ordered(batches()):
+            for record in batch:
+                yield record
+
+    async def run(self, input_path: str, output_path: str, resume: bool = True) -> Dict[str, Any]:
+        """Process a JSONL file into another, checkpointing after every batch."""
+        checkpoint_path = f"{output_path}.checkpoint"
+        state = _load_checkpoint(checkpoint_path)
+
+        if resume and state['output_offset'] and os.path.exists(output_path):
+            if os.path.getsize(output_path) < state['output_offset']:
+                raise RuntimeError(f"{output_path} is shorter than its checkpoint; rerun with --no-resume")
+            # Drop anything written after the last checkpoint
+            os.truncate(output_path, state['output_offset'])
+            mode = 'ab'
+        else:
+            state = {"input_offset": 0, "output_offset": 0, "lines": 0}
+            mode = 'wb'
+
+        if state['lines']:
+            logger.info(f"Resuming {input_path} at line {state['lines']}")
+
+        start = time.monotonic()
+        written = 0
+        with open(input_path, 'rb') as input_file, open(output_path, mode) as output_file:
+            input_file.seek(state['input_offset'])
+            batches = _read_batches(input_file, self.batch_size, state['input_offset'], state['lines'])
+
+            async for (input_offset, lines), batch in self._ordered(batches):
+                output_file.write(b''.join(
+                    json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n' for record in batch
+                ))
+                output_file.flush()
+
+                state = {
+                    "input_offset": input_offset,
+                    "output_offset": output_file.tell(),
+                    "lines": lines
+                }
+                _save_checkpoint(checkpoint_path, state)
+
+                written += 1
+                if written % PROGRESS_EVERY == 0:
+                    rate = self.processed / max(time.monotonic() - start, 1e-9)
+                    logger.info(f"{state['lines']} lines done ({rate:.0f} records/s, {self.errors} errors)")
+
+        elapsed = time.monotonic() - start
+        return {
+            "lines": state['lines'],
+            "processed": self.processed,
+            "errors": self.errors,
+            "elapsed_s": round(elapsed, 3),
+            "records_per_second": round(self.processed / elapsed, 1) if elapsed else None
+        }
+
+async def run(args) -> Dict[str, Any]:
+    from http_client import client_manager
+    from provider_registry import create_provider_registry
+    from provider_router import create_provider_router
+
+    sentiment = None
+    if not args.no_sentiment:
+        sentiment = SentimentService(executor_type=args.executor, max_workers=args.workers)
+        await sentiment.start()
+
+    provider = None
+    if not args.no_replies:
+        await client_manager.start()
+        provider_registry = create_provider_registry()
+        # Replies go through the router for its timeouts, retries and failover
+        router = create_provider_router(dict(provider_registry.providers))
+        provider = router.provider(args.provider or provider_registry.default)
+
+    processor = BulkProcessor(
+        sentiment=sentiment,
+        provider=provider,
+        concurrency=args.concurrency,
+        batch_size=args.batch_size,
+        window=args.window or max(4, 2 * args.workers),
+        text_field=args.text_field,
+        history_field=args.history_field
+    )
+    try:
+        return await processor.run(args.input, args.output, resume=not args.no_resume)
+    finally:
+        if sentiment is not None:
+            await sentiment.close()
+        if provider is not None:
+            await client_manager.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='JSONL file of records to process')
+    parser.add_argument('output', help='JSONL file for the enriched records')
+    parser.add_argument('--provider', help='provider for replies (default: DEFAULT_PROVIDER)')
+    parser.add_argument('--no-replies', action='store_true', help='only score sentiment')
+    parser.add_argument('--no-sentiment', action='store_true', help='only generate replies')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='sentiment worker processes')
+    parser.add_argument('--executor', choices=['process', 'thread'], default='process')
+    parser.add_argument('--concurrency', type=int, default=8, help='provider calls in flight')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--window', type=int, help='batches in flight (default: 2 per worker, at least 4)')
+    parser.add_argument('--text-field', default='message')
+    parser.add_argument('--history-field', default='history')
+    parser.add_argument('--no-resume', action='store_true', help='start over, ignoring any checkpoint')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == "__main__":
+    main()
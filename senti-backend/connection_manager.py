@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Set, Optional, Callable, Awaitable
+from fastapi import WebSocket
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Called on the owning worker with (connection_id, message)
+Deliver = Callable[[str, str], Awaitable[bool]]
+
+class RegistryBackend(ABC):
+    """Where connections are registered and how messages reach their worker."""
+
+    async def start(self, worker_id: str, deliver: Deliver):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def register(self, connection_id: str, worker_id: str):
+        pass
+
+    @abstractmethod
+    async def unregister(self, connection_id: str):
+        pass
+
+    @abstractmethod
+    async def locate(self, connection_id: str) -> Optional[str]:
+        """Id of the worker holding the connection, if any."""
+
+    @abstractmethod
+    async def count(self) -> int:
+        pass
+
+    @abstractmethod
+    async def publish(self, worker_id: str, connection_id: str, message: str) -> bool:
+        """Hand a message to another worker; False if nobody received it."""
+
+class MemoryRegistryBackend(RegistryBackend):
+    """Registry for a single process."""
+
+    def __init__(self):
+        self._connections: Dict[str, str] = {}
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, worker_id: str, deliver: Deliver):
+        self._deliver = deliver
+
+    async def register(self, connection_id: str, worker_id: str):
+        self._connections[connection_id] = worker_id
+
+    async def unregister(self, connection_id: str):
+        self._connections.pop(connection_id, None)
+
+    async def locate(self, connection_id: str) -> Optional[str]:
+        return self._connections.get(connection_id)
+
+    async def count(self) -> int:
+        return len(self._connections)
+
+    async def publish(self, worker_id: str, connection_id: str, message: str) -> bool:
+        if self._deliver is None:
+            return False
+        return await self._deliver(connection_id, message)
+
+class RedisRegistryBackend(RegistryBackend):
+    """Registry shared by every worker through a Redis-compatible server.
+
+    Each connection has its own key (connection id -> worker id) and each
+    worker a set of the connections it holds; all of them expire unless
+    the worker's heartbeat keeps refreshing them, so a crashed worker's
+    entries disappear on their own after `ttl` seconds. Live workers are
+    tracked in a sorted set scored by their last heartbeat.
+
+    Each worker subscribes to its own pub/sub channel for messages
+    addressed to connections it holds; the listener is restarted if its
+    connection drops. Any server speaking the Redis protocol works, and
+    tests can pass in a local stand-in client.
+    """
+
+    def __init__(
+        self,
+        url: str = 'redis://localhost:6379/0',
+        client=None,
+        prefix: str = 'senti',
+        ttl: float = 30.0
+    ):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("CONNECTION_BACKEND=redis requires the redis package")
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self._ttl_ms = int(ttl * 1000)
+        self.workers_key = f'{prefix}:workers'
+        self.worker_id: Optional[str] = None
+        # Connections registered by this worker, refreshed by the heartbeat
+        self._held: Set[str] = set()
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    def _channel(self, worker_id: str) -> str:
+        return f'{self.prefix}:worker:{worker_id}'
+
+    def _connection_key(self, connection_id: str) -> str:
+        return f'{self.prefix}:connection:{connection_id}'
+
+    def _held_key(self, worker_id: str) -> str:
+        return f'{self.prefix}:worker:{worker_id}:connections'
+
+    async def start(self, worker_id: str, deliver: Deliver):
+        self.worker_id = worker_id
+        await self._beat()
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen(deliver))
+        self._heartbeat = asyncio.create_task(self._beat_forever())
+
+    async def _subscribe(self):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self._channel(self.worker_id))
+
+    async def _listen(self, deliver: Deliver):
+        delay = 0.5
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                async for item in self._pubsub.listen():
+                    delay = 0.5
+                    try:
+                        payload = json.loads(item['data'])
+                        await deliver(payload['connection_id'], payload['message'])
+                    except Exception as e:
+                        logger.error(f"Error delivering routed message: {str(e)}")
+                logger.warning("Registry subscription ended; resubscribing")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Registry listener failed, restarting in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.ttl)
+            # Messages published while resubscribing are lost, as they
+            # would be for a worker that restarted
+            await self._drop_pubsub()
+
+    async def _drop_pubsub(self):
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.aclose()
+            except Exception as e:
+                logger.debug(f"Error closing registry subscription: {str(e)}")
+            self._pubsub = None
+
+    async def _beat(self):
+        """Mark this worker alive and extend the lifetime of its entries."""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zadd(self.workers_key, {self.worker_id: time.time()})
+        pipe.pexpire(self._held_key(self.worker_id), self._ttl_ms)
+        for connection_id in self._held:
+            pipe.pexpire(self._connection_key(connection_id), self._ttl_ms)
+        await pipe.execute()
+
+    async def _beat_forever(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self._beat()
+            except Exception as e:
+                # Keep beating; entries survive until `ttl` runs out
+                logger.error(f"Registry heartbeat failed: {str(e)}")
+
+    async def close(self):
+        # Runs during app shutdown: a failing step is logged, not raised, so
+        # the rest of shutdown (and of this method) still happens
+        for task in (self._heartbeat, self._listener):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                except Exception as e:
+                    logger.error(f"Registry task failed: {str(e)}")
+        self._heartbeat = self._listener = None
+        await self._drop_pubsub()
+        if self.worker_id is not None:
+            try:
+                # Its entries would expire anyway; this just drops it from count() sooner
+                await self.client.zrem(self.workers_key, self.worker_id)
+            except Exception as e:
+                logger.error(f"Error deregistering worker: {str(e)}")
+        try:
+            await self.client.aclose()
+        except Exception as e:
+            logger.error(f"Error closing registry client: {str(e)}")
+
+    async def register(self, connection_id: str, worker_id: str):
+        self._held.add(connection_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self._connection_key(connection_id), worker_id, px=self._ttl_ms)
+        pipe.sadd(self._held_key(worker_id), connection_id)
+        pipe.pexpire(self._held_key(worker_id), self._ttl_ms)
+        await pipe.execute()
+
+    async def unregister(self, connection_id: str):
+        self._held.discard(connection_id)
+        key = self._connection_key(connection_id)
+        worker_id = await self.client.get(key)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(key)
+        if worker_id is not None:
+            pipe.srem(self._held_key(worker_id), connection_id)
+        await pipe.execute()
+
+    async def locate(self, connection_id: str) -> Optional[str]:
+        return await self.client.get(self._connection_key(connection_id))
+
+    async def count(self) -> int:
+        # Forget workers that stopped beating; their sets expire by themselves
+        await self.client.zremrangebyscore(self.workers_key, '-inf', time.time() - self.ttl)
+        workers = await self.client.zrange(self.workers_key, 0, -1)
+        if not workers:
+            return 0
+        pipe = self.client.pipeline(transaction=False)
+        for worker_id in workers:
+            pipe.scard(self._held_key(worker_id))
+        return sum(await pipe.execute())
+
+    async def publish(self, worker_id: str, connection_id: str, message: str) -> bool:
+        payload = json.dumps({"connection_id": connection_id, "message": message})
+        return await self.client.publish(self._channel(worker_id), payload) > 0
+
+class ConnectionManager:
+    def __init__(self, backend: Optional[RegistryBackend] = None):
+        self.backend = backend or MemoryRegistryBackend()
+        self.worker_id = uuid.uuid4().hex
+        # Sockets held by this worker; the backend knows about all of them
+        self.active_connections: Dict[str, WebSocket] = {}
+
+    async def start(self):
+        await self.backend.start(self.worker_id, self._deliver)
+
+    async def close(self):
+        for connection_id in list(self.active_connections):
+            try:
+                await self.disconnect(connection_id)
+            except Exception as e:
+                logger.error(f"Error unregistering connection {connection_id}: {str(e)}")
+        await self.backend.close()
+
+    async def connect(self, websocket: WebSocket, subprotocol: Optional[str] = None) -> str:
+        """Handle a new connection."""
+        # Only echo a subprotocol the client offered; `?encoding=` clients
+        # offered none, and a spec-compliant client rejects any other answer
+        offered = websocket.scope.get('subprotocols', [])
+        await websocket.accept(subprotocol=subprotocol if subprotocol in offered else None)
+        # Random ids can't collide across workers, unlike a per-process counter
+        connection_id = uuid.uuid4().hex
+        self.active_connections[connection_id] = websocket
+        await self.backend.register(connection_id, self.worker_id)
+        return connection_id
+
+    def bind(self, connection_id: str, websocket):
+        """Route this connection's messages through a wrapper (e.g. its send queue)."""
+        self.active_connections[connection_id] = websocket
+
+    async def disconnect(self, connection_id: str):
+        """Disconnect a client."""
+        if connection_id in self.active_connections:
+            del self.active_connections[connection_id]
+        await self.backend.unregister(connection_id)
+
+    async def count(self) -> int:
+        """Connections across every worker."""
+        return await self.backend.count()
+
+    async def send_message(self, connection_id: str, message: str) -> bool:
+        """Send a message to a connection, wherever it is held."""
+        if connection_id in self.active_connections:
+            return await self._deliver(connection_id, message)
+
+        worker_id = await self.backend.locate(connection_id)
+        if worker_id is None:
+            return False
+        if not await self.backend.publish(worker_id, connection_id, message):
+            # The owning worker is gone; drop its stale registration
+            logger.warning(f"No worker received message for connection {connection_id}")
+            await self.backend.unregister(connection_id)
+            return False
+        return True
+
+    async def _deliver(self, connection_id: str, message: str) -> bool:
+        websocket = self.active_connections.get(connection_id)
+        if websocket is None:
+            return False
+        try:
+            await websocket.send_text(message)
+            return True
+        except Exception as e:
+            logger.error(f"Error sending message: {str(e)}")
+            await self.disconnect(connection_id)
+            return False
+
+def create_connection_manager() -> ConnectionManager:
+    """Build a connection manager from CONNECTION_BACKEND, REDIS_URL and REGISTRY_TTL."""
+    if os.getenv('CONNECTION_BACKEND', 'memory') == 'redis':
+        backend: RegistryBackend = RedisRegistryBackend(
+            os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            ttl=float(os.getenv('REGISTRY_TTL', '30'))
+        )
+    else:
+        backend = MemoryRegistryBackend()
+    return ConnectionManager(backend)
@@ -0,0 +1,144 @@
+import os
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Callable
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from session_store import estimate_tokens
+
+Turn = Dict[str, Any]
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are Senti, a supportive and empathetic conversational companion. "
+    "Adapt your tone to the user's sentiment and keep answers concise."
+)
+
+def token_counter(provider: str, model: str) -> Callable[[str], int]:
+    """Token counter for a provider's tokenizer, falling back to an estimate."""
+    if provider == 'openai' and tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+
+        # History turns are recounted every request, so remember them
+        @lru_cache(maxsize=4096)
+        def count(text: str) -> int:
+            return len(encoding.encode(text))
+        return count
+    return estimate_tokens
+
+class ContextBuilder:
+    """Builds provider-specific prompts from a conversation without mutating it.
+
+    Every prompt starts with the same system prompt followed by history in
+    order, so consecutive turns share a long identical prefix that upstream
+    prompt caches and Ollama's KV cache can reuse. When history exceeds the
+    token budget the oldest turns are dropped in blocks of `trim_step`, so
+    the cut point (and with it the prefix) moves once per block instead of
+    on every request.
+    """
+
+    # Role markers and separators each chat message costs on top of its text
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(
+        self,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        max_tokens: int = 4000,
+        trim_step: int = 8,
+        token_counter: Callable[[str], int] = estimate_tokens
+    ):
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.trim_step = max(1, trim_step)
+        self.token_counter = token_counter
+
+    def _cost(self, text: str) -> int:
+        return self.token_counter(text) + self.MESSAGE_OVERHEAD
+
+    @staticmethod
+    def sentiment_note(sentiment: Optional[Dict[str, Any]]) -> Optional[str]:
+        return f"Sentiment Context: {sentiment}" if sentiment else None
+
+    def window(
+        self,
+        text: str,
+        session_memory: Optional[List[Turn]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> List[Turn]:
+        """The most recent history turns that fit the budget alongside the new turn."""
+        history = session_memory or []
+        note = self.sentiment_note(sentiment)
+        total = self._cost(text) + (self._cost(note) if note else 0)
+        if self.system_prompt:
+            total += self._cost(self.system_prompt)
+
+        costs = [self._cost(turn.get('content', '')) for turn in history]
+        total += sum(costs)
+
+        cut = 0
+        while total > self.max_tokens and cut < len(history):
+            step_end = min(len(history), cut + self.trim_step)
+            total -= sum(costs[cut:step_end])
+            cut = step_end
+        return history[cut:]
+
+    def chat_messages(
+        self,
+        text: str,
+        session_memory: Optional[List[Turn]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """OpenAI-style messages (also used by Ollama and OpenAI-compatible servers)."""
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        for turn in self.window(text, session_memory, sentiment):
+            messages.append({"role": turn.get('role', 'user'), "content": turn.get('content', '')})
+        messages.append({"role": "user", "content": text})
+
+        # Per-turn context goes last so it never breaks the shared prefix
+        note = self.sentiment_note(sentiment)
+        if note:
+            messages.append({"role": "system", "content": note})
+        return messages
+
+    def gemini_contents(
+        self,
+        text: str,
+        session_memory: Optional[List[Turn]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """Gemini contents; the system prompt is set on the model as its system instruction."""
+        contents: List[Dict[str, Any]] = []
+
+        def add(role: str, part: str):
+            # Gemini only knows user/model turns, so runs of one role are merged
+            if contents and contents[-1]['role'] == role:
+                contents[-1]['parts'].append(part)
+            else:
+                contents.append({"role": role, "parts": [part]})
+
+        for turn in self.window(text, session_memory, sentiment):
+            role = 'model' if turn.get('role') == 'assistant' else 'user'
+            add(role, turn.get('content', ''))
+        add('user', text)
+
+        note = self.sentiment_note(sentiment)
+        if note:
+            add('user', f"[{note}]")
+        return contents
+
+def create_context_builder(provider: str, model: str) -> ContextBuilder:
+    """Build a provider's context builder from SYSTEM_PROMPT and CONTEXT_* variables."""
+    max_tokens = os.getenv(f'{provider.upper()}_CONTEXT_TOKENS') or os.getenv('CONTEXT_MAX_TOKENS', '4000')
+    return ContextBuilder(
+        system_prompt=os.getenv('SYSTEM_PROMPT', DEFAULT_SYSTEM_PROMPT),
+        max_tokens=int(max_tokens),
+        trim_step=int(os.getenv('CONTEXT_TRIM_STEP', '8')),
+        token_counter=token_counter(provider, model)
+    )
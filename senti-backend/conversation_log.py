@@ -0,0 +1,396 @@
+import os
+import json
+import mmap
+import zlib
+import struct
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+Turn = Dict[str, Any]
+
+LOG_MAGIC = b'SENTILOG'
+INDEX_MAGIC = b'SENTIIDX'
+# Both files start with a magic and a generation; compaction bumps the
+# generation, so an index left over from before a compaction is detected
+FILE_HEADER = struct.Struct('<8sQ')
+# Every record is its payload's length and CRC-32, then the JSON payload
+RECORD_HEADER = struct.Struct('<II')
+OFFSET = struct.Struct('<Q')
+
+class UserLog:
+    """One user's append-only turn log and its offset index.
+
+    `<path>.log` holds length-prefixed, checksummed JSON records and
+    `<path>.idx` an array of 8-byte record offsets, so turn i is found
+    without scanning the log. A record is written to the log before its
+    offset is written to the index, so every indexed record is complete;
+    when a log is opened, records past the last indexed one are indexed
+    and a torn tail left by a crash is cut off. Reads go through read-only
+    memory maps of both files.
+
+    Writers in other worker processes are serialized with a lock file.
+    Once the log holds more than twice `max_turns` records it is compacted
+    down to the newest `max_turns`, so appends stay amortized O(1).
+    """
+
+    def __init__(self, path: str, max_turns: int = 10000, fsync: bool = False):
+        self.log_path = f'{path}.log'
+        self.index_path = f'{path}.idx'
+        self.lock_path = f'{path}.lock'
+        self.max_turns = max_turns
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._log = None
+        self._index = None
+        self._log_map: Optional[mmap.mmap] = None
+        self._index_map: Optional[mmap.mmap] = None
+        self._generation = 0
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold the cross-process lock (a no-op where flock is unavailable)."""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _open_files(self):
+        """(Re)open the log and index; the caller holds the cross-process lock."""
+        self._close_files()
+        # Appends always go to the end of the file, whatever was read last
+        self._log = open(self.log_path, 'a+b')
+        self._index = open(self.index_path, 'a+b')
+        self._recover()
+
+    def _ensure_open(self):
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a+b')
+        if self._log is None or self._replaced():
+            with self._exclusive():
+                self._open_files()
+
+    @contextmanager
+    def _writing(self):
+        """Hold the cross-process lock over the current log and index."""
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a+b')
+        with self._exclusive():
+            # Another worker may have compacted since the files were opened;
+            # writing to the replaced (unlinked) files would lose the turns
+            if self._log is None or self._replaced():
+                self._open_files()
+            yield
+
+    def _replaced(self) -> bool:
+        """Whether another process compacted the files since they were opened."""
+        try:
+            return (
+                os.stat(self.log_path).st_ino != os.fstat(self._log.fileno()).st_ino
+                or os.stat(self.index_path).st_ino != os.fstat(self._index.fileno()).st_ino
+            )
+        except FileNotFoundError:
+            return True
+
+    def _recover(self):
+        """Bring the index in line with the log after an unclean shutdown."""
+        log_size = os.fstat(self._log.fileno()).st_size
+        if log_size < FILE_HEADER.size:
+            # A new log (or one torn while being created)
+            self._log.truncate(0)
+            self._log.write(FILE_HEADER.pack(LOG_MAGIC, 0))
+            self._log.flush()
+            self._reset_index(0)
+            self._generation = 0
+            return
+
+        self._log.seek(0)
+        magic, self._generation = FILE_HEADER.unpack(self._log.read(FILE_HEADER.size))
+        if magic != LOG_MAGIC:
+            raise RuntimeError(f"{self.log_path} is not a conversation log")
+
+        self._index.seek(0)
+        header = self._index.read(FILE_HEADER.size)
+        start = FILE_HEADER.size
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header) != (INDEX_MAGIC, self._generation):
+            logger.warning(f"Rebuilding index {self.index_path}")
+            self._reset_index(self._generation)
+        else:
+            count = (os.fstat(self._index.fileno()).st_size - FILE_HEADER.size) // OFFSET.size
+            # Re-check the last indexed record along with anything after it
+            if count:
+                count -= 1
+                self._index.seek(FILE_HEADER.size + count * OFFSET.size)
+                start = OFFSET.unpack(self._index.read(OFFSET.size))[0]
+            if start > log_size:
+                logger.warning(f"Rebuilding index {self.index_path}")
+                self._reset_index(self._generation)
+                start = FILE_HEADER.size
+            else:
+                self._index.truncate(FILE_HEADER.size + count * OFFSET.size)
+
+        self._log.seek(start)
+        offsets, end = self._scan(self._log.read(log_size - start), start)
+        if offsets:
+            self._index.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+            self._index.flush()
+        if end < log_size:
+            logger.warning(f"Dropping {log_size - end} torn bytes from {self.log_path}")
+            self._log.truncate(end)
+
+    def _reset_index(self, generation: int):
+        self._index.truncate(0)
+        self._index.write(FILE_HEADER.pack(INDEX_MAGIC, generation))
+        self._index.flush()
+
+    @staticmethod
+    def _scan(data: bytes, base: int) -> Tuple[List[int], int]:
+        """Offsets of the complete records in `data` (read from `base`), and where they end."""
+        offsets = []
+        position = 0
+        view = memoryview(data)
+        while position + RECORD_HEADER.size <= len(data):
+            length, crc = RECORD_HEADER.unpack_from(data, position)
+            end = position + RECORD_HEADER.size + length
+            if end > len(data) or zlib.crc32(view[position + RECORD_HEADER.size:end]) != crc:
+                break
+            offsets.append(base + position)
+            position = end
+        return offsets, base + position
+
+    def _maps(self) -> Tuple[mmap.mmap, mmap.mmap]:
+        """Read-only maps of the index and log covering everything appended so far."""
+        # The index is sized first: every offset in it points at a record
+        # that was already in the log when it was written
+        for name, file in (('_index_map', self._index), ('_log_map', self._log)):
+            current = getattr(self, name)
+            if current is None or len(current) < os.fstat(file.fileno()).st_size:
+                if current is not None:
+                    current.close()
+                setattr(self, name, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._index_map, self._log_map
+
+    @staticmethod
+    def _count(index_map: mmap.mmap) -> int:
+        return (len(index_map) - FILE_HEADER.size) // OFFSET.size
+
+    @staticmethod
+    def _offset(index_map: mmap.mmap, i: int) -> int:
+        return OFFSET.unpack_from(index_map, FILE_HEADER.size + i * OFFSET.size)[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._ensure_open()
+            return self._count(self._maps()[0])
+
+    def append(self, turns: List[Turn]) -> int:
+        """Append turns; returns how many old turns a compaction dropped, if one ran."""
+        payloads = [
+            json.dumps(turn, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            for turn in turns
+        ]
+        with self._lock:
+            with self._writing():
+                offset = os.fstat(self._log.fileno()).st_size
+                records = []
+                offsets = []
+                for payload in payloads:
+                    offsets.append(offset)
+                    records.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+                    offset += len(records[-1])
+
+                self._log.write(b''.join(records))
+                self._log.flush()
+                if self.fsync:
+                    os.fsync(self._log.fileno())
+                self._index.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+                self._index.flush()
+
+                count = (os.fstat(self._index.fileno()).st_size - FILE_HEADER.size) // OFFSET.size
+                if self.max_turns and count > 2 * self.max_turns:
+                    return self._compact(self.max_turns)
+                return 0
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> List[Turn]:
+        """Turns `start` to `stop`, indexed (and sliced) like a list."""
+        with self._lock:
+            self._ensure_open()
+            index_map, log_map = self._maps()
+            turns = []
+            for i in range(self._count(index_map))[start:stop]:
+                offset = self._offset(index_map, i)
+                length = RECORD_HEADER.unpack_from(log_map, offset)[0]
+                payload_start = offset + RECORD_HEADER.size
+                turns.append(json.loads(log_map[payload_start:payload_start + length]))
+            return turns
+
+    def tail(self, n: int) -> List[Turn]:
+        """The newest `n` turns, oldest first."""
+        return self.read(-n) if n > 0 else []
+
+    def compact(self, keep: Optional[int] = None) -> int:
+        """Rewrite the log keeping only the newest `keep` turns; returns how many were dropped."""
+        with self._lock:
+            with self._writing():
+                return self._compact(self.max_turns if keep is None else keep)
+
+    def _compact(self, keep: int) -> int:
+        index_map, log_map = self._maps()
+        count = self._count(index_map)
+        if count <= keep:
+            return 0
+
+        generation = self._generation + 1
+        tmp_log_path = f'{self.log_path}.tmp'
+        tmp_index_path = f'{self.index_path}.tmp'
+        with open(tmp_log_path, 'wb') as log, open(tmp_index_path, 'wb') as index:
+            records = []
+            offsets = []
+            position = FILE_HEADER.size
+            for i in range(count - keep, count):
+                offset = self._offset(index_map, i)
+                length = RECORD_HEADER.unpack_from(log_map, offset)[0]
+                records.append(log_map[offset:offset + RECORD_HEADER.size + length])
+                offsets.append(position)
+                position += len(records[-1])
+
+            log.write(FILE_HEADER.pack(LOG_MAGIC, generation))
+            log.write(b''.join(records))
+            index.write(FILE_HEADER.pack(INDEX_MAGIC, generation))
+            index.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+            if self.fsync:
+                log.flush()
+                index.flush()
+                os.fsync(log.fileno())
+                os.fsync(index.fileno())
+
+        # A crash between the two leaves an index of the wrong generation,
+        # which is rebuilt from the log when it is next opened
+        os.replace(tmp_log_path, self.log_path)
+        os.replace(tmp_index_path, self.index_path)
+        self._close_files()
+        self._log = open(self.log_path, 'a+b')
+        self._index = open(self.index_path, 'a+b')
+        self._generation = generation
+        return count - keep
+
+    def _close_files(self):
+        for name in ('_log_map', '_index_map', '_log', '_index'):
+            resource = getattr(self, name)
+            if resource is not None:
+                resource.close()
+                setattr(self, name, None)
+
+    def close(self):
+        with self._lock:
+            self._close_files()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+class ConversationArchive:
+    """Every user's conversation log under one directory.
+
+    Logs are keyed by a hash of the user id and kept open (with their
+    maps) for the `max_open` most recently used users. File I/O runs in a
+    worker thread so it never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        directory: str = 'conversations',
+        max_turns: int = 10000,
+        max_open: int = 128,
+        restore_turns: int = 20,
+        fsync: bool = False
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_turns = max_turns
+        self.max_open = max_open
+        self.restore_turns = restore_turns
+        self.fsync = fsync
+        self._logs: 'OrderedDict[str, UserLog]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.appends = 0
+        self.tail_reads = 0
+        self.compactions = 0
+
+    def log(self, user_id: str) -> UserLog:
+        """The user's log, opening it if needed and closing the least recently used."""
+        key = hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:32]
+        evicted = []
+        with self._lock:
+            log = self._logs.get(key)
+            if log is None:
+                log = UserLog(os.path.join(self.directory, key), self.max_turns, self.fsync)
+                self._logs[key] = log
+            self._logs.move_to_end(key)
+            while len(self._logs) > self.max_open:
+                evicted.append(self._logs.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return log
+
+    async def append(self, user_id: str, *turns: Turn):
+        dropped = await asyncio.to_thread(self.log(user_id).append, list(turns))
+        self.appends += len(turns)
+        if dropped:
+            self.compactions += 1
+
+    async def tail(self, user_id: str, n: Optional[int] = None) -> List[Turn]:
+        """The user's newest turns (`restore_turns` by default), oldest first."""
+        turns = await asyncio.to_thread(self.log(user_id).tail, self.restore_turns if n is None else n)
+        self.tail_reads += 1
+        return turns
+
+    async def compact(self, user_id: str, keep: Optional[int] = None) -> int:
+        dropped = await asyncio.to_thread(self.log(user_id).compact, keep)
+        if dropped:
+            self.compactions += 1
+        return dropped
+
+    def close(self):
+        with self._lock:
+            logs = list(self._logs.values())
+            self._logs.clear()
+        for log in logs:
+            log.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open_logs": len(self._logs),
+            "appends": self.appends,
+            "tail_reads": self.tail_reads,
+            "compactions": self.compactions
+        }
+
+def create_conversation_archive() -> Optional[ConversationArchive]:
+    """Build the archive from the CONVERSATION_LOG_* environment variables, if enabled."""
+    if os.getenv('CONVERSATION_LOG', 'false').lower() != 'true':
+        return None
+
+    return ConversationArchive(
+        directory=os.getenv('CONVERSATION_LOG_DIR', 'conversations'),
+        max_turns=int(os.getenv('CONVERSATION_LOG_MAX_TURNS', '10000')),
+        max_open=int(os.getenv('CONVERSATION_LOG_MAX_OPEN', '128')),
+        restore_turns=int(os.getenv('CONVERSATION_LOG_RESTORE_TURNS', '20')),
+        fsync=os.getenv('CONVERSATION_LOG_FSYNC', 'false').lower() == 'true'
+    )
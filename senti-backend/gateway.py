@@ -0,0 +1,587 @@
+import os
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator, Type, Union
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from starlette.websockets import WebSocketState
+from dotenv import load_dotenv
+
+from provider_registry import create_provider_registry, warm_up_providers
+from connection_manager import create_connection_manager
+from http_client import client_manager
+from session_store import create_session_store
+from identity import create_user_tokens
+from conversation_log import create_conversation_archive
+from memory_index import create_memory_index, format_memories
+from response_cache import CachedProvider, create_response_cache
+from sentiment_service import sentiment_service
+from provider_router import create_provider_router
+from hedging import create_hedged_provider
+from batching import BatchingProvider, create_batching_provider
+from image_pipeline import image_pipeline
+from wire_protocol import WireSocket, ProtocolError, negotiate_subprotocol
+from outbound import OutboundQueue, create_outbound_queue
+from inflight import TooManyTurns, create_inflight_turns, new_turn_id
+from admission import Busy, create_admission_controller
+from metrics import registry, loop_lag_monitor, span, CHAT_TURN_SECONDS
+from messages import (
+    Message,
+    ChatMessage,
+    ImageMessage,
+    CancelMessage,
+    ResumeMessage,
+    PingMessage,
+    ConnectMessage,
+    ChangeModelMessage,
+    SentimentMessage,
+    UnknownMessage,
+    parse_message
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Open the shared HTTP pools before the first request
+    await client_manager.start()
+    await manager.start()
+    await sentiment_service.start()
+    await image_pipeline.start()
+    await loop_lag_monitor.start()
+    await warm_up_providers(provider_registry)
+    try:
+        yield
+    finally:
+        await client_manager.close()
+        await manager.close()
+        await sentiment_service.close()
+        await image_pipeline.close()
+        await loop_lag_monitor.close()
+        if conversation_log is not None:
+            conversation_log.close()
+        if memory_index is not None:
+            memory_index.close()
+
+# One app for both websocket paths: `/` and `/ai` (older clients)
+app = FastAPI(
+    title="Senti AI Backend",
+    description="AI-powered conversational backend",
+    version="0.1.0",
+    lifespan=lifespan
+)
+
+# Add CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        os.getenv('CORS_ORIGIN_1', 'http://localhost:8765'),  # Local development
+        os.getenv('CORS_ORIGIN_2', 'http://10.0.2.2:8765'),   # Android emulator
+        os.getenv('CORS_ORIGIN_3', 'capacitor://localhost'),  # Capacitor iOS/Android
+        os.getenv('CORS_ORIGIN_4', 'ionic://localhost'),      # Ionic framework
+        "*"  # Be cautious with this in production
+    ],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Providers (and their SDKs) are initialized on first use
+provider_registry = create_provider_registry()
+
+# Repeated prompts are answered from cache; paraphrase matching is opt-in
+semantic_cache = os.getenv('RESPONSE_CACHE_SEMANTIC', 'false').lower() == 'true'
+response_cache = create_response_cache(
+    embedder=provider_registry.get('gemini').embed if semantic_cache and 'gemini' in provider_registry else None
+)
+
+# Upstream calls are bounded, retried and failed over by the router
+provider_router = create_provider_router({
+    # Local backends can batch concurrent calls into short windows
+    name: create_batching_provider(provider) if name in ('ollama', 'llama') else provider
+    for name, provider in provider_registry.providers.items()
+})
+
+# Provider selection mapping
+llm_providers = {
+    name: CachedProvider(provider_router.provider(name), response_cache, name)
+    for name in provider_router.providers
+}
+
+# Connection tracking and server-side conversation history
+manager = create_connection_manager()
+session_store = create_session_store()
+# Per-user state is only kept for users identified by a signed token
+user_tokens = create_user_tokens()
+# Long-term, per-user conversation logs on local disk (opt-in)
+conversation_log = create_conversation_archive()
+if conversation_log is not None and user_tokens is None:
+    logger.warning("CONVERSATION_LOG needs USER_TOKEN_SECRET to identify users; leaving it off")
+    conversation_log = None
+# Past exchanges recalled by similarity to each new message (opt-in)
+memory_index = create_memory_index()
+if memory_index is not None and user_tokens is None:
+    logger.warning("MEMORY_INDEX needs USER_TOKEN_SECRET to identify users; leaving it off")
+    memory_index.close()
+    memory_index = None
+inflight = create_inflight_turns()
+admission = create_admission_controller()
+
+registry.gauge(
+    'senti_active_websockets',
+    'Open websocket connections.',
+    lambda: len(manager.active_connections)
+)
+
+@dataclass
+class Connection:
+    """Per-connection state handed to every message handler."""
+
+    websocket: Any
+    connection_id: str
+    session_id: str
+    path: str
+    # From a verified user token, never from a client-stated user_id
+    user_id: Optional[str] = None
+    # Set by change_model; used when a turn names no provider itself
+    provider: Optional[str] = None
+
+    async def send(self, frame: Dict[str, Any]):
+        await self.websocket.send_json(frame)
+
+@app.get("/ai")
+async def read_ai():
+    return {"message": "This is the AI endpoint."}
+
+def resolve_provider(conn: Connection, message: Union[ChatMessage, ImageMessage]) -> str:
+    """Provider named by `provider` (or `model`, as older clients send it), else the connection's."""
+    for name in (message.provider, message.model, conn.provider):
+        if name in llm_providers:
+            return name
+    return provider_registry.default
+
+def identify(conn: Connection, token: Optional[str]):
+    """Bind the connection to the user a signed token names."""
+    if token is None or user_tokens is None:
+        return
+    user_id = user_tokens.verify(token)
+    if user_id is None:
+        logger.warning(f"Connection {conn.connection_id} sent an invalid user token")
+        return
+    conn.user_id = user_id
+
+async def restore_history(conn: Connection) -> List[Dict[str, Any]]:
+    """Seed a fresh session with the newest turns from the user's conversation log."""
+    try:
+        turns = await conversation_log.tail(conn.user_id)
+    except Exception as e:
+        logger.error(f"Conversation log read error: {e}")
+        return []
+    if turns:
+        await session_store.add_turns(
+            conn.connection_id,
+            *[{"role": turn['role'], "content": turn['content']} for turn in turns]
+        )
+    return await session_store.history(conn.connection_id)
+
+async def archive_turns(conn: Connection, *turns: Dict[str, Any]):
+    try:
+        await conversation_log.append(conn.user_id, *turns)
+    except Exception as e:
+        logger.error(f"Conversation log write error: {e}")
+
+async def recall(conn: Connection, text: str, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """History plus a note of the user's past exchanges relevant to `text`."""
+    try:
+        memories = await memory_index.search(
+            conn.user_id,
+            text,
+            exclude=[turn.get('content') for turn in history if turn.get('role') == 'user']
+        )
+    except Exception as e:
+        logger.error(f"Memory recall error: {e}")
+        return history
+    if not memories:
+        return history
+    # After the history, so the prompt prefix shared with earlier turns stays intact
+    return history + [{"role": "system", "content": format_memories(memories)}]
+
+async def remember(conn: Connection, text: str, response: str):
+    try:
+        await memory_index.add(conn.user_id, text, response)
+    except Exception as e:
+        logger.error(f"Memory index write error: {e}")
+
+async def admitted(conn: Connection, turn_id: str, turn: Callable[[], Awaitable[None]]):
+    """Run a turn once it holds a generation slot, or tell the client to retry."""
+    try:
+        async with admission.slot():
+            await turn()
+    except Busy as e:
+        logger.warning(f"Turn {turn_id} refused: {e}")
+        try:
+            await conn.send({**e.to_dict(), "turn_id": turn_id})
+        except WebSocketDisconnect:
+            pass
+
+async def chat_turn(conn: Connection, message: ChatMessage):
+    """Answer one chat turn, streamed or as a single chat_response."""
+    turn_id = message.turn_id
+    provider_name = resolve_provider(conn, message)
+    provider = llm_providers[provider_name]
+
+    # Opt-in: race several providers and keep the fastest
+    hedged = None
+    if message.hedge:
+        hedged = create_hedged_provider(
+            provider_router,
+            provider_name,
+            message.hedge,
+            message.hedge_providers
+        )
+        provider = CachedProvider(hedged, response_cache, provider_name)
+
+    # One span and timing sample per chat turn
+    streaming = message.stream or message.type == 'stream'
+    with span('chat_turn', provider=provider_name, stream=streaming), \
+            CHAT_TURN_SECONDS.time(endpoint=conn.path, stream=str(streaming).lower()):
+        try:
+            # Prefer client-sent history for older clients, else the server-side window
+            if message.history:
+                history = [turn.model_dump() for turn in message.history]
+            else:
+                history = await session_store.history(conn.connection_id)
+            if not history and conn.user_id and conversation_log is not None:
+                # A new session picks up where the user's last one left off
+                history = await restore_history(conn)
+            if conn.user_id and memory_index is not None:
+                history = await recall(conn, message.message, history)
+            sentiment = await sentiment_service.analyze(message.message)
+
+            if streaming:
+                # Forward tokens to the client as they arrive
+                chunks = []
+                async for chunk in provider.stream_response(
+                    text=message.message,
+                    session_memory=history,
+                    sentiment=sentiment
+                ):
+                    chunks.append(chunk)
+                    await conn.send({
+                        "type": "stream",
+                        "content": chunk,
+                        "done": False,
+                        "model": (hedged and hedged.winner) or provider_name,
+                        "turn_id": turn_id
+                    })
+
+                await conn.send({
+                    "type": "stream",
+                    "content": "",
+                    "done": True,
+                    "model": (hedged and hedged.winner) or provider_name,
+                    "turn_id": turn_id
+                })
+                response = ''.join(chunks)
+            else:
+                response = await provider.generate_response(
+                    text=message.message,
+                    session_memory=history,
+                    sentiment=sentiment
+                )
+                await conn.send({
+                    "type": "chat_response",
+                    "response": response,
+                    "model": (hedged and hedged.winner) or provider_name,
+                    "turn_id": turn_id
+                })
+
+            turns = (
+                {"role": "user", "content": message.message},
+                {"role": "assistant", "content": response}
+            )
+            await session_store.add_turns(conn.connection_id, *turns)
+            if conn.user_id and conversation_log is not None:
+                await archive_turns(conn, *turns)
+            if conn.user_id and memory_index is not None:
+                await remember(conn, message.message, response)
+
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            await conn.send({
+                "type": "error",
+                "error": str(e),
+                "turn_id": turn_id
+            })
+
+async def image_turn(conn: Connection, message: ImageMessage):
+    """Describe one image, reusing descriptions of repeated frames."""
+    turn_id = message.turn_id
+    provider_name = resolve_provider(conn, message)
+    provider = llm_providers[provider_name]
+
+    try:
+        # Decoding and downscaling happen in the image worker pool
+        image = await image_pipeline.prepare(message.image)
+
+        # Camera streams repeat frames; reuse the last description
+        description = image_pipeline.find_duplicate(conn.connection_id, image)
+        duplicate = description is not None
+        if not duplicate:
+            description = await provider.analyze_image(image.base64)
+            image_pipeline.remember(conn.connection_id, image, description)
+
+        await conn.send({
+            "type": "image_response",
+            "response": description,
+            "model": provider_name,
+            "duplicate": duplicate,
+            "turn_id": turn_id
+        })
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error analyzing image: {e}")
+        await conn.send({
+            "type": "error",
+            "error": str(e),
+            "turn_id": turn_id
+        })
+
+async def start_turn(
+    conn: Connection,
+    message: Union[ChatMessage, ImageMessage],
+    lane: str,
+    turn: Callable[[], Awaitable[None]],
+    supersede: bool = False
+):
+    """Run a turn as a task so the receive loop keeps reading (cancel, more turns)."""
+    # Clients sending too fast are refused before any work starts
+    busy = admission.check_rate(conn.connection_id, conn.user_id, lane=lane)
+    if busy is not None:
+        await conn.send({**busy.to_dict(), "turn_id": message.turn_id})
+        return
+
+    try:
+        superseded = inflight.start(
+            conn.connection_id,
+            message.turn_id,
+            admitted(conn, message.turn_id, turn),
+            lane=lane,
+            supersede=supersede
+        )
+    except TooManyTurns as e:
+        await conn.send({
+            "type": "error",
+            "error": str(e),
+            "turn_id": message.turn_id
+        })
+        return
+
+    for cancelled_id in superseded:
+        await conn.send({
+            "type": "cancelled",
+            "turn_id": cancelled_id,
+            "reason": "superseded"
+        })
+
+async def handle_chat(conn: Connection, message: ChatMessage):
+    # Older clients send their session id on every frame instead of `resume`
+    if message.session_id and message.session_id != conn.session_id:
+        conn.session_id = session_store.open(conn.connection_id, message.session_id)
+    identify(conn, message.user_token)
+
+    message.turn_id = message.turn_id or new_turn_id()
+    # A new chat turn supersedes the previous one unless it is concurrent
+    await start_turn(
+        conn, message, 'chat', partial(chat_turn, conn, message), supersede=not message.concurrent
+    )
+
+async def handle_image(conn: Connection, message: ImageMessage):
+    message.turn_id = message.turn_id or new_turn_id()
+    await start_turn(conn, message, 'image', partial(image_turn, conn, message))
+
+async def handle_cancel(conn: Connection, message: CancelMessage):
+    # Stop one turn, or everything in flight on this connection
+    for cancelled_id in inflight.cancel(conn.connection_id, message.turn_id):
+        await conn.send({
+            "type": "cancelled",
+            "turn_id": cancelled_id,
+            "reason": "cancelled"
+        })
+
+async def handle_resume(conn: Connection, message: ResumeMessage):
+    # Continue a previous session's history on this connection
+    conn.session_id = session_store.open(conn.connection_id, message.session_id)
+    await conn.send({
+        "type": "session",
+        "session_id": conn.session_id
+    })
+
+async def handle_ping(conn: Connection, message: PingMessage):
+    await conn.send({"type": "pong"})
+
+async def handle_connect(conn: Connection, message: ConnectMessage):
+    identify(conn, message.user_token)
+    logger.info(f"Connection {conn.connection_id} is a {message.platform or 'unknown'} client")
+
+async def handle_change_model(conn: Connection, message: ChangeModelMessage):
+    if message.model in llm_providers:
+        conn.provider = message.model
+    else:
+        logger.warning(f"Connection {conn.connection_id} asked for unknown provider {message.model}")
+    await conn.send({
+        "type": "model_changed",
+        "model": conn.provider or provider_registry.default
+    })
+
+async def handle_sentiment(conn: Connection, message: SentimentMessage):
+    sentiment = await sentiment_service.analyze(message.text)
+    await conn.send({
+        "type": "sentiment_analysis",
+        "sentiment": sentiment['label'],
+        "polarity": sentiment['polarity']
+    })
+
+# Every message type and the handler it is dispatched to
+HANDLERS: Dict[Type[Message], Callable[[Connection, Any], Awaitable[None]]] = {
+    ChatMessage: handle_chat,
+    ImageMessage: handle_image,
+    CancelMessage: handle_cancel,
+    ResumeMessage: handle_resume,
+    PingMessage: handle_ping,
+    ConnectMessage: handle_connect,
+    ChangeModelMessage: handle_change_model,
+    SentimentMessage: handle_sentiment
+}
+
+@app.websocket("/")
+@app.websocket("/ai")
+async def websocket_endpoint(websocket: WebSocket):
+    logger.info("WebSocket connection attempt received")
+    conn = None
+    try:
+        # JSON text frames by default, MessagePack binary frames if negotiated
+        subprotocol = negotiate_subprotocol(websocket)
+        connection_id = await manager.connect(websocket, subprotocol)
+        outbound = create_outbound_queue(WireSocket(websocket, subprotocol))
+        manager.bind(connection_id, outbound)
+        conn = Connection(
+            websocket=outbound,
+            connection_id=connection_id,
+            session_id=session_store.open(connection_id),
+            path=websocket.scope['path']
+        )
+        logger.info(f"WebSocket connection accepted on {conn.path} ({subprotocol or 'json'})")
+
+        # Tell the client which session to resume after a reconnect
+        await conn.send({
+            "type": "session",
+            "session_id": conn.session_id
+        })
+
+        # Decode, validate, dispatch
+        while True:
+            try:
+                message = parse_message(await outbound.receive_json())
+            except UnknownMessage as e:
+                # Clients send frames this server has no use for; an error
+                # frame would end their pending turn
+                logger.debug(f"Ignored frame: {e}")
+                continue
+            except ProtocolError as e:
+                logger.warning(f"Rejected frame: {e}")
+                await conn.send({
+                    "type": "error",
+                    "error": str(e)
+                })
+                continue
+            await HANDLERS[type(message)](conn, message)
+
+    except WebSocketDisconnect:
+        logger.info("Client disconnected")
+    except Exception as e:
+        logger.error(f"WebSocket error: {e}")
+        if websocket.client_state != WebSocketState.DISCONNECTED:
+            await websocket.close(code=1011)
+    finally:
+        if conn is not None:
+            # Nobody is listening any more, so stop paying for generation
+            inflight.cancel(conn.connection_id)
+            admission.forget(conn.connection_id)
+            await conn.websocket.stop()
+            await manager.disconnect(conn.connection_id)
+            session_store.close(conn.connection_id)
+            image_pipeline.forget(conn.connection_id)
+
+@app.get("/health")
+async def health_check():
+    return {
+        "status": "healthy",
+        "connections": len(manager.active_connections)
+    }
+
+@app.get("/status")
+async def get_status():
+    return {
+        # Every worker's connections; this worker's own are in worker_connections
+        "active_connections": await manager.count(),
+        "worker_connections": len(manager.active_connections),
+        "worker_pid": os.getpid(),
+        "providers": provider_registry.stats(),
+        "http_pool": client_manager.stats(),
+        "response_cache": response_cache.stats(),
+        "provider_stats": provider_router.stats(),
+        "batching": {
+            name: provider.stats()
+            for name, provider in provider_router.providers.items()
+            if isinstance(provider, BatchingProvider)
+        },
+        "outbound": OutboundQueue.stats(),
+        "turns": inflight.stats(),
+        "admission": admission.stats(),
+        "sentiment": sentiment_service.stats(),
+        "images": image_pipeline.stats(),
+        "conversation_log": conversation_log.stats() if conversation_log is not None else None,
+        "memory": memory_index.stats() if memory_index is not None else None
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def run():
+    """Serve the gateway with WEB_CONCURRENCY worker processes."""
+    import uvicorn
+
+    workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+    if workers > 1 and os.getenv('CONNECTION_BACKEND', 'memory') != 'redis':
+        # Each worker would only see its own connections and sessions
+        logger.warning("Running several workers without CONNECTION_BACKEND=redis")
+
+    logger.info(f"Starting gateway with {workers} worker(s)...")
+    uvicorn.run(
+        # Workers import the app themselves, so it is passed by name
+        "gateway:app",
+        host=os.getenv('HOST', '0.0.0.0'),
+        port=int(os.getenv('PORT', '8765')),
+        workers=workers,
+        log_level="info",
+        # permessage-deflate for clients that offer it
+        ws_per_message_deflate=os.getenv('WS_PER_MESSAGE_DEFLATE', 'true').lower() == 'true'
+    )
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,141 @@
+import os
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+
+from llm_providers import BaseLLMProvider, ProviderError
+from provider_router import ProviderRouter
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = object()
+
+async def _first_chunk(stream: AsyncIterator[str]) -> Any:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return _EMPTY
+
+class HedgedProvider(BaseLLMProvider):
+    """Races one prompt across several providers and keeps the first to answer.
+
+    In 'race' mode every provider starts at once. In 'delayed' mode the
+    backups only start if the primary has produced nothing within `delay`.
+    The winner's name is left on `winner` for the reply frame.
+    """
+
+    def __init__(
+        self,
+        candidates: List[Tuple[str, BaseLLMProvider]],
+        mode: str = 'race',
+        delay: Optional[float] = None
+    ):
+        self.candidates = candidates
+        self.mode = mode
+        self.delay = delay
+        self.winner: Optional[str] = None
+        # Lets the response cache key on the primary's model
+        self.model = getattr(candidates[0][1], 'model', '')
+
+    async def generate_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> str:
+        return ''.join([chunk async for chunk in self.stream_response(text, session_memory, sentiment)])
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        pending: Dict[asyncio.Task, Tuple[str, AsyncIterator[str]]] = {}
+        waiting = list(self.candidates)
+        errors = []
+
+        def launch(count: int):
+            for name, provider in waiting[:count]:
+                stream = provider.stream_response(text, session_memory, sentiment)
+                pending[asyncio.create_task(_first_chunk(stream))] = (name, stream)
+            del waiting[:count]
+
+        launch(1 if self.mode == 'delayed' else len(waiting))
+
+        winner = None
+        try:
+            while pending and winner is None:
+                # In delayed mode, give the primary until `delay` before hedging
+                timeout = self.delay if waiting else None
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.info(f"No first token within {timeout:.2f}s, sending hedge requests")
+                    launch(len(waiting))
+                    continue
+
+                for task in done:
+                    name, stream = pending.pop(task)
+                    if task.exception() is None and winner is None:
+                        winner = (name, stream, task.result())
+                    else:
+                        if task.exception() is not None:
+                            errors.append(str(task.exception()))
+                        await stream.aclose()
+
+                # A failed primary shouldn't wait out the hedge delay
+                if winner is None and not pending and waiting:
+                    launch(len(waiting))
+        finally:
+            await self._cancel(pending)
+
+        if winner is None:
+            raise ProviderError(f"All hedged providers failed: {'; '.join(errors)}")
+
+        name, stream, first = winner
+        self.winner = name
+        if first is _EMPTY:
+            return
+
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    async def _cancel(self, pending: Dict[asyncio.Task, Tuple[str, AsyncIterator[str]]]):
+        """Cancel the losing requests and release their upstream connections."""
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for name, stream in pending.values():
+            await stream.aclose()
+        pending.clear()
+
+    async def analyze_image(self, image_base64: str) -> str:
+        return await self.candidates[0][1].analyze_image(image_base64)
+
+def create_hedged_provider(
+    router: ProviderRouter,
+    primary: str,
+    mode: Any = 'race',
+    names: Optional[List[str]] = None
+) -> HedgedProvider:
+    """Hedge `primary` against the configured (or requested) backup providers."""
+    if names is None:
+        names = [name.strip() for name in os.getenv('HEDGE_PROVIDERS', 'gemini,openai').split(',')]
+    names = [primary] + [name for name in names if name != primary and name in router.providers]
+
+    # `"hedge": true` on a message means a plain race
+    mode = 'delayed' if mode == 'delayed' else 'race'
+    delay = None
+    if mode == 'delayed':
+        # The hedge fires if the first token is late, so wait on first-token latency
+        delay = router.ttft_p95(primary) or float(os.getenv('HEDGE_DEFAULT_DELAY', '1.0'))
+
+    # Each leg goes to exactly one upstream; the race itself is the failover
+    candidates = [(name, router.provider(name, failover=False)) for name in names]
+    return HedgedProvider(candidates, mode=mode, delay=delay)
@@ -0,0 +1,131 @@
+import os
+import logging
+from typing import Dict, Any, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+class ClientManager:
+    """Long-lived HTTP clients shared by every LLM provider."""
+
+    def __init__(self):
+        # Pool configuration, tunable per deployment
+        self.limit = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+        self.limit_per_host = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '20'))
+        self.keepalive_timeout = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+        self.dns_cache_ttl = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+        self.request_timeout = float(os.getenv('HTTP_REQUEST_TIMEOUT', '120'))
+        self.ollama_host = os.getenv('OLLAMA_HOST')
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ollama_client: Optional[Any] = None
+
+    async def start(self):
+        """Open the shared pools (called on application startup)."""
+        # The Ollama client (and its SDK) is only created once a provider needs it
+        _ = self.session
+        logger.info(
+            f"HTTP client pool started (limit={self.limit}, "
+            f"per_host={self.limit_per_host}, keepalive={self.keepalive_timeout}s)"
+        )
+
+    async def close(self):
+        """Close the shared pools (called on application shutdown)."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+        if self._ollama_client is not None:
+            await self._ollama_client._client.aclose()
+        self._ollama_client = None
+
+        logger.info("HTTP client pool closed")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Shared aiohttp session, opened lazily when used outside the app lifecycle."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+            )
+        return self._session
+
+    def bind_openai(self):
+        """Point the legacy openai SDK at the shared session for the current task."""
+        # openai reads its aiohttp session from a context var, so this has to
+        # run in the task that makes the request rather than once at startup
+        import openai
+        openai.aiosession.set(self.session)
+
+    @property
+    def ollama(self) -> Any:
+        """Shared Ollama client."""
+        if self._ollama_client is None:
+            # Imported on first use so deployments without Ollama don't pay for it
+            import httpx
+            import ollama
+            self._ollama_client = ollama.AsyncClient(
+                host=self.ollama_host,
+                timeout=self.request_timeout,
+                limits=httpx.Limits(
+                    max_connections=self.limit,
+                    max_keepalive_connections=self.limit_per_host,
+                    keepalive_expiry=self.keepalive_timeout
+                )
+            )
+        return self._ollama_client
+
+    def stats(self) -> Dict[str, Any]:
+        """Open / idle / in-flight connection counts for each pool."""
+        return {
+            "aiohttp": self._aiohttp_stats(),
+            "ollama": self._ollama_stats(),
+            "limits": {
+                "limit": self.limit,
+                "limit_per_host": self.limit_per_host,
+                "keepalive_timeout": self.keepalive_timeout,
+                "dns_cache_ttl": self.dns_cache_ttl
+            }
+        }
+
+    def _aiohttp_stats(self) -> Dict[str, Any]:
+        if self._session is None or self._session.closed:
+            return {"open": 0, "idle": 0, "in_flight": 0, "started": False}
+
+        connector = self._session.connector
+        in_flight = len(getattr(connector, '_acquired', ()))
+        idle = sum(len(conns) for conns in getattr(connector, '_conns', {}).values())
+        return {
+            "open": in_flight + idle,
+            "idle": idle,
+            "in_flight": in_flight,
+            "started": True
+        }
+
+    def _ollama_stats(self) -> Dict[str, Any]:
+        if self._ollama_client is None:
+            return {"open": 0, "idle": 0, "in_flight": 0, "started": False}
+
+        # httpx keeps its connections on the transport's httpcore pool
+        transport = getattr(self._ollama_client._client, '_transport', None)
+        pool = getattr(transport, '_pool', None)
+        connections = list(getattr(pool, 'connections', []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "open": len(connections),
+            "idle": idle,
+            "in_flight": len(connections) - idle,
+            "started": True
+        }
+
+# Shared instance used by all providers
+client_manager = ClientManager()
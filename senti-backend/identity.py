@@ -0,0 +1,58 @@
+import os
+import hmac
+import time
+import hashlib
+from typing import Optional
+
+class UserTokens:
+    """Signed user tokens: `<user_id>.<expires>.<signature>` (HMAC-SHA256).
+
+    Per-user state (the conversation archive, long-term memory) is keyed
+    on the user id inside a valid token, never on a `user_id` a client
+    states about itself, so a client can only reach the state of an
+    identity it was issued. Tokens are minted with the same secret by
+    whatever authenticates users, via issue().
+    """
+
+    def __init__(self, secret: str, ttl: float = 30 * 86400):
+        if not secret:
+            raise ValueError("User tokens need a secret")
+        self.secret = secret.encode('utf-8')
+        self.ttl = ttl
+
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def issue(self, user_id: str, ttl: Optional[float] = None) -> str:
+        expires = int(time.time() + (self.ttl if ttl is None else ttl))
+        payload = f"{user_id}.{expires}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[str]:
+        """The user id of a valid, unexpired token, else None."""
+        payload, _, signature = token.rpartition('.')
+        user_id, _, expires = payload.rpartition('.')
+        if not user_id or not hmac.compare_digest(self._sign(payload), signature):
+            return None
+        try:
+            if int(expires) < time.time():
+                return None
+        except ValueError:
+            return None
+        return user_id
+
+def create_user_tokens() -> Optional[UserTokens]:
+    """Token verification from USER_TOKEN_SECRET, or None if no secret is configured."""
+    secret = os.getenv('USER_TOKEN_SECRET')
+    if not secret:
+        return None
+    return UserTokens(secret, ttl=float(os.getenv('USER_TOKEN_TTL', str(30 * 86400))))
+
+if __name__ == "__main__":
+    # Mint a token for a user, e.g. from a deployment script
+    import sys
+
+    tokens = create_user_tokens()
+    if tokens is None or len(sys.argv) != 2:
+        raise SystemExit("usage: USER_TOKEN_SECRET=... python identity.py <user_id>")
+    print(tokens.issue(sys.argv[1]))
@@ -0,0 +1,173 @@
+import io
+import os
+import base64
+import asyncio
+import binascii
+import logging
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple, Deque, Union
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class ImageRejected(ValueError):
+    """Raised when an image is too large or can't be decoded."""
+
+@dataclass
+class PreparedImage:
+    base64: str
+    mime_type: str
+    width: int
+    height: int
+    size: int
+    phash: int
+
+def _dhash(image: Image.Image) -> int:
+    """64-bit difference hash; near-identical frames differ in only a few bits."""
+    small = image.convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def _process(
+    image_data: Union[str, bytes],
+    max_bytes: int,
+    max_pixels: int,
+    max_dimension: int,
+    quality: int
+) -> Tuple[str, int, int, int, int]:
+    """Decode, validate, downscale and re-encode one image (runs in a worker)."""
+    if isinstance(image_data, bytes):
+        # Binary frames carry the raw image, no base64 to undo
+        data = image_data
+    else:
+        try:
+            data = base64.b64decode(image_data, validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise ImageRejected(f"Invalid base64 image: {str(e)}")
+    if len(data) > max_bytes:
+        raise ImageRejected(f"Image is {len(data)} bytes, limit is {max_bytes}")
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > max_pixels:
+            raise ImageRejected(f"Image is {image.width}x{image.height}, too many pixels")
+        # draft() lets the JPEG decoder skip detail we'd throw away anyway
+        image.draft('RGB', (max_dimension, max_dimension))
+        image = image.convert('RGB')
+    except ImageRejected:
+        raise
+    except Exception as e:
+        raise ImageRejected(f"Unreadable image: {str(e)}")
+
+    image.thumbnail((max_dimension, max_dimension))
+    phash = _dhash(image)
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    jpeg = output.getvalue()
+    return base64.b64encode(jpeg).decode('ascii'), len(jpeg), image.width, image.height, phash
+
+class ImagePipeline:
+    """Off-loop image ingestion with size caps and near-duplicate detection."""
+
+    def __init__(self):
+        self.executor_type = os.getenv('IMAGE_EXECUTOR', 'process')
+        self.max_workers = int(os.getenv('IMAGE_WORKERS', '2'))
+        self.max_bytes = int(os.getenv('IMAGE_MAX_BYTES', str(8 * 1024 * 1024)))
+        self.max_pixels = int(os.getenv('IMAGE_MAX_PIXELS', str(40_000_000)))
+        self.max_dimension = int(os.getenv('IMAGE_MAX_DIMENSION', '1024'))
+        self.quality = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+        self.dedup_distance = int(os.getenv('IMAGE_DEDUP_DISTANCE', '5'))
+        self.dedup_window = int(os.getenv('IMAGE_DEDUP_WINDOW', '8'))
+
+        self._executor: Optional[Executor] = None
+        # Recent (hash, description) pairs per connection
+        self._recent: Dict[str, Deque[Tuple[int, str]]] = {}
+        self.processed = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    async def start(self):
+        _ = self.executor
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def prepare(self, image: Union[str, bytes]) -> PreparedImage:
+        """Validate and compact a base64 or raw image in the worker pool."""
+        # base64 is 4/3 the size of the payload, so oversize frames are
+        # refused before anything is decoded
+        size = len(image) if isinstance(image, bytes) else len(image) * 3 // 4
+        if size > self.max_bytes:
+            self.rejected += 1
+            raise ImageRejected(f"Image exceeds {self.max_bytes} bytes")
+
+        loop = asyncio.get_running_loop()
+        try:
+            encoded, size, width, height, phash = await loop.run_in_executor(
+                self.executor,
+                _process,
+                image,
+                self.max_bytes,
+                self.max_pixels,
+                self.max_dimension,
+                self.quality
+            )
+        except ImageRejected:
+            self.rejected += 1
+            raise
+
+        self.processed += 1
+        return PreparedImage(
+            base64=encoded,
+            mime_type='image/jpeg',
+            width=width,
+            height=height,
+            size=size,
+            phash=phash
+        )
+
+    def find_duplicate(self, key: str, image: PreparedImage) -> Optional[str]:
+        """Description of a recent near-identical frame from the same client."""
+        for phash, description in self._recent.get(key, ()):
+            if bin(phash ^ image.phash).count('1') <= self.dedup_distance:
+                self.duplicates += 1
+                return description
+        return None
+
+    def remember(self, key: str, image: PreparedImage, description: str):
+        recent = self._recent.setdefault(key, deque(maxlen=self.dedup_window))
+        recent.appendleft((image.phash, description))
+
+    def forget(self, key: str):
+        self._recent.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processed": self.processed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected
+        }
+
+# Shared instance used by the websocket handlers
+image_pipeline = ImagePipeline()
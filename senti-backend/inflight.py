@@ -0,0 +1,98 @@
+import os
+import uuid
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, Awaitable, Tuple
+
+logger = logging.getLogger(__name__)
+
+class TooManyTurns(Exception):
+    """Raised when a connection already has its maximum of turns in flight."""
+
+class InflightTurns:
+    """In-flight turn tasks per connection, so they can be cancelled.
+
+    Each turn runs as its own task, which keeps the receive loop free for
+    `cancel` messages and concurrent turns. A turn belongs to a lane
+    ('chat', 'image'); starting one with `supersede=True` cancels the
+    connection's other turns in that lane, and reusing a turn id replaces
+    the earlier turn.
+    """
+
+    def __init__(self, max_per_connection: int = 4):
+        self.max_per_connection = max_per_connection
+        self._turns: Dict[str, Dict[str, Tuple[str, asyncio.Task]]] = {}
+        self.started = 0
+        self.cancelled = 0
+
+    def start(
+        self,
+        connection_id: str,
+        turn_id: str,
+        coro: Awaitable[Any],
+        lane: str = 'chat',
+        supersede: bool = False
+    ) -> List[str]:
+        """Run `coro` as a tracked turn; returns the ids of turns it superseded."""
+        superseded = self.cancel(connection_id, lane=lane) if supersede else []
+        if turn_id in self._turns.get(connection_id, {}):
+            superseded += self.cancel(connection_id, turn_id)
+
+        turns = self._turns.setdefault(connection_id, {})
+        if len(turns) >= self.max_per_connection:
+            coro.close()
+            raise TooManyTurns(f"{len(turns)} turns already in flight")
+
+        task = asyncio.create_task(coro)
+        turns[turn_id] = (lane, task)
+        task.add_done_callback(lambda done: self._finished(connection_id, turn_id, done))
+        self.started += 1
+        return superseded
+
+    def _finished(self, connection_id: str, turn_id: str, task: asyncio.Task):
+        turns = self._turns.get(connection_id)
+        if turns and turns.get(turn_id, (None, None))[1] is task:
+            del turns[turn_id]
+            if not turns:
+                del self._turns[connection_id]
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Turn {turn_id} failed: {task.exception()}")
+
+    def cancel(
+        self,
+        connection_id: str,
+        turn_id: Optional[str] = None,
+        lane: Optional[str] = None
+    ) -> List[str]:
+        """Cancel one turn, a lane, or (with neither) every turn of a connection."""
+        turns = self._turns.get(connection_id, {})
+        cancelled = []
+        for tid, (turn_lane, task) in list(turns.items()):
+            if turn_id is not None and tid != turn_id:
+                continue
+            if lane is not None and turn_lane != lane:
+                continue
+            # Cancelling propagates into the provider call and closes upstream streams
+            task.cancel()
+            del turns[tid]
+            cancelled.append(tid)
+
+        if not turns:
+            self._turns.pop(connection_id, None)
+        self.cancelled += len(cancelled)
+        return cancelled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": sum(len(turns) for turns in self._turns.values()),
+            "started": self.started,
+            "cancelled": self.cancelled
+        }
+
+def new_turn_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+def create_inflight_turns() -> InflightTurns:
+    """Build the turn tracker from INFLIGHT_MAX_TURNS."""
+    return InflightTurns(int(os.getenv('INFLIGHT_MAX_TURNS', '4')))
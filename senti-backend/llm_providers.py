@@ -1,106 +1,217 @@
 import os
+import json
 import base64
-import aiohttp
-import google.generativeai as genai
-import openai
-import ollama
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
+
+from http_client import client_manager
+from context_builder import create_context_builder
+
+class ProviderError(Exception):
+    """Raised when an upstream LLM call fails."""
+
+class ProviderInputError(ProviderError):
+    """Raised when a provider rejects the request itself (a 4xx other than 408/429).
+
+    The same request would fail again anywhere, so it is neither retried,
+    failed over, nor counted against the provider's health.
+    """
+
+def _status(e: Exception) -> Optional[int]:
+    # SDKs name the HTTP status differently (openai, ollama, aiohttp, google)
+    for attr in ('http_status', 'status_code', 'status', 'code'):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+def _upstream_error(message: str, e: Exception) -> ProviderError:
+    status = _status(e)
+    if status is not None and 400 <= status < 500 and status not in (408, 429):
+        return ProviderInputError(message)
+    return ProviderError(message)
 
 class BaseLLMProvider(ABC):
     @abstractmethod
     async def generate_response(
-        self, 
-        text: str, 
-        session_memory: Optional[List[Dict[str, Any]]] = None, 
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
         sentiment: Optional[Dict[str, Any]] = None
     ) -> str:
         pass
 
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """Yield the response as it is generated.
+
+        Providers without native streaming yield the full response once.
+        """
+        yield await self.generate_response(text, session_memory, sentiment)
+
     @abstractmethod
     async def analyze_image(self, image_base64: str) -> str:
         pass
 
+    @classmethod
+    def configured_model(cls) -> str:
+        """Model name from configuration, known without constructing the provider."""
+        return ''
+
+    async def warm_up(self):
+        """Open the upstream connection ahead of the first request."""
+
 class GeminiProvider(BaseLLMProvider):
     def __init__(self):
+        # The SDK is heavy, so it is only imported once the provider is used
+        import google.generativeai as genai
+        self.genai = genai
+
         # Load API key from environment variable
         api_key = os.getenv('GEMINI_API_KEY', 'YOUR_GEMINI_API_KEY')
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.context = create_context_builder('gemini', self.configured_model())
+        # A fixed system instruction keeps every request's prefix identical
+        self.model = genai.GenerativeModel(
+            self.configured_model(),
+            system_instruction=self.context.system_prompt or None
+        )
         self.vision_model = genai.GenerativeModel('gemini-pro-vision')
 
+    @classmethod
+    def configured_model(cls) -> str:
+        return 'gemini-2.0-flash-exp'
+
+    async def warm_up(self):
+        # A token count is free and opens the async client's channel
+        await self.model.count_tokens_async("ping")
+
     async def generate_response(
-        self, 
-        text: str, 
-        session_memory: Optional[List[Dict[str, Any]]] = None, 
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
         sentiment: Optional[Dict[str, Any]] = None
     ) -> str:
-        try:
-            # Prepare context with session memory and sentiment
-            context = text
-            if session_memory:
-                context = ' '.join([m.get('content', '') for m in session_memory]) + ' ' + text
-            
-            if sentiment:
-                context += f" [Sentiment Context: {sentiment}]"
+        contents = self.context.gemini_contents(text, session_memory, sentiment)
 
+        try:
             # Generate response
-            response = await self.model.generate_content_async(context)
+            response = await self.model.generate_content_async(contents)
             return response.text
         except Exception as e:
-            return f"Gemini generation error: {str(e)}"
+            raise _upstream_error(f"Gemini generation error: {str(e)}", e) from e
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        contents = self.context.gemini_contents(text, session_memory, sentiment)
+
+        try:
+            # Async streaming keeps the event loop free between chunks
+            response = await self.model.generate_content_async(contents, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            raise _upstream_error(f"Gemini generation error: {str(e)}", e) from e
+
+    async def embed(self, text: str) -> List[float]:
+        """Embedding vector for `text`, used for semantic cache lookups."""
+        # embed_content is synchronous, so keep it off the event loop
+        result = await asyncio.to_thread(
+            self.genai.embed_content,
+            model=os.getenv('GEMINI_EMBEDDING_MODEL', 'models/text-embedding-004'),
+            content=text
+        )
+        return result['embedding']
 
     async def analyze_image(self, image_base64: str) -> str:
         try:
             # Decode base64 image
             image_data = base64.b64decode(image_base64)
-            
+
             # Analyze image
             response = await self.vision_model.generate_content_async([
                 "Describe this image in detail.",
-                image_data
+                {"mime_type": "image/jpeg", "data": image_data}
             ])
             return response.text
         except Exception as e:
-            return f"Gemini image analysis error: {str(e)}"
+            raise _upstream_error(f"Gemini image analysis error: {str(e)}", e) from e
 
 class OpenAIProvider(BaseLLMProvider):
     def __init__(self):
+        import openai
+        self.openai = openai
+
         # Load API key from environment variable
         openai.api_key = os.getenv('OPENAI_API_KEY')
-        self.model = 'gpt-3.5-turbo'
+        self.model = self.configured_model()
+        self.context = create_context_builder('openai', self.model)
+
+    @classmethod
+    def configured_model(cls) -> str:
+        return 'gpt-3.5-turbo'
+
+    async def warm_up(self):
+        client_manager.bind_openai()
+        await self.openai.Model.alist()
 
     async def generate_response(
-        self, 
-        text: str, 
-        session_memory: Optional[List[Dict[str, Any]]] = None, 
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
         sentiment: Optional[Dict[str, Any]] = None
     ) -> str:
-        try:
-            # Prepare messages for OpenAI
-            messages = session_memory or []
-            messages.append({"role": "user", "content": text})
-            
-            # Add sentiment context if available
-            if sentiment:
-                messages.append({
-                    "role": "system", 
-                    "content": f"Sentiment Context: {sentiment}"
-                })
+        # Prepare messages for OpenAI
+        messages = self.context.chat_messages(text, session_memory, sentiment)
 
-            # Generate response
-            response = await openai.ChatCompletion.acreate(
+        try:
+            # Generate response over the shared connection pool
+            client_manager.bind_openai()
+            response = await self.openai.ChatCompletion.acreate(
                 model=self.model,
                 messages=messages
             )
             return response.choices[0].message.content
         except Exception as e:
-            return f"OpenAI generation error: {str(e)}"
+            raise _upstream_error(f"OpenAI generation error: {str(e)}", e) from e
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        messages = self.context.chat_messages(text, session_memory, sentiment)
+
+        try:
+            client_manager.bind_openai()
+            response = await self.openai.ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                stream=True
+            )
+            async for chunk in response:
+                content = chunk.choices[0].delta.get('content')
+                if content:
+                    yield content
+        except Exception as e:
+            raise _upstream_error(f"OpenAI generation error: {str(e)}", e) from e
 
     async def analyze_image(self, image_base64: str) -> str:
         try:
             # OpenAI Vision API (if available)
-            response = await openai.ChatCompletion.acreate(
+            client_manager.bind_openai()
+            response = await self.openai.ChatCompletion.acreate(
                 model="gpt-4-vision-preview",
                 messages=[
                     {
@@ -114,115 +225,173 @@ class OpenAIProvider(BaseLLMProvider):
             )
             return response.choices[0].message.content
         except Exception as e:
-            return f"OpenAI image analysis error: {str(e)}"
+            raise _upstream_error(f"OpenAI image analysis error: {str(e)}", e) from e
 
 class OllamaProvider(BaseLLMProvider):
     def __init__(self):
         # Ollama endpoint configuration
         self.endpoint = os.getenv('OLLAMA_ENDPOINT', 'http://localhost:11434/api/chat')
-        self.model = os.getenv('OLLAMA_MODEL', 'llama2')
+        self.model = self.configured_model()
+        self.context = create_context_builder('ollama', self.model)
+        # Keeping the model loaded lets Ollama reuse the KV cache of the shared prefix
+        self.keep_alive = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+
+    @classmethod
+    def configured_model(cls) -> str:
+        return os.getenv('OLLAMA_MODEL', 'llama2')
+
+    async def warm_up(self):
+        await client_manager.ollama.list()
 
     async def generate_response(
-        self, 
-        text: str, 
-        session_memory: Optional[List[Dict[str, Any]]] = None, 
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
         sentiment: Optional[Dict[str, Any]] = None
     ) -> str:
-        try:
-            # Prepare messages for Ollama
-            messages = session_memory or []
-            messages.append({"role": "user", "content": text})
-            
-            # Add sentiment context if available
-            if sentiment:
-                messages.append({
-                    "role": "system", 
-                    "content": f"Sentiment Context: {sentiment}"
-                })
+        # Prepare messages for Ollama
+        messages = self.context.chat_messages(text, session_memory, sentiment)
 
+        try:
             # Generate response via Ollama
-            response = await ollama.AsyncClient().chat(
+            response = await client_manager.ollama.chat(
                 model=self.model,
-                messages=messages
+                messages=messages,
+                keep_alive=self.keep_alive
             )
             return response['message']['content']
         except Exception as e:
-            return f"Ollama generation error: {str(e)}"
+            raise _upstream_error(f"Ollama generation error: {str(e)}", e) from e
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        messages = self.context.chat_messages(text, session_memory, sentiment)
+
+        try:
+            stream = await client_manager.ollama.chat(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                keep_alive=self.keep_alive
+            )
+            async for part in stream:
+                content = part['message']['content']
+                if content:
+                    yield content
+        except Exception as e:
+            raise _upstream_error(f"Ollama generation error: {str(e)}", e) from e
 
     async def analyze_image(self, image_base64: str) -> str:
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(image_base64)
-            
-            # Analyze image (if Ollama supports vision)
-            response = await ollama.AsyncClient().chat(
+            # Analyze image (if Ollama supports vision); the API takes base64 as-is
+            response = await client_manager.ollama.chat(
                 model=self.model,
                 messages=[
                     {
-                        "role": "user", 
+                        "role": "user",
                         "content": "Describe this image in detail.",
-                        "images": [image_data]
+                        "images": [image_base64]
                     }
                 ]
             )
             return response['message']['content']
         except Exception as e:
-            return f"Ollama image analysis error: {str(e)}"
+            raise _upstream_error(f"Ollama image analysis error: {str(e)}", e) from e
 
 class LlamaProvider(BaseLLMProvider):
     def __init__(self):
         # Llama endpoint configuration
         self.endpoint = os.getenv('LLAMA_ENDPOINT', 'http://localhost:8000/v1/chat/completions')
-        self.model = os.getenv('LLAMA_MODEL', 'llama-2-7b-chat')
+        self.model = self.configured_model()
+        self.context = create_context_builder('llama', self.model)
+
+    @classmethod
+    def configured_model(cls) -> str:
+        return os.getenv('LLAMA_MODEL', 'llama-2-7b-chat')
+
+    async def warm_up(self):
+        # OpenAI-compatible servers list their models next to the chat endpoint
+        models_url = self.endpoint.rsplit('/chat/completions', 1)[0] + '/models'
+        async with client_manager.session.get(models_url) as response:
+            await response.read()
 
     async def generate_response(
-        self, 
-        text: str, 
-        session_memory: Optional[List[Dict[str, Any]]] = None, 
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
         sentiment: Optional[Dict[str, Any]] = None
     ) -> str:
-        try:
-            # Prepare messages for Llama
-            messages = session_memory or []
-            messages.append({"role": "user", "content": text})
-            
-            # Add sentiment context if available
-            if sentiment:
-                messages.append({
-                    "role": "system", 
-                    "content": f"Sentiment Context: {sentiment}"
-                })
+        # Prepare messages for Llama
+        messages = self.context.chat_messages(text, session_memory, sentiment)
 
+        try:
             # Generate response via Llama API
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.endpoint, json={
-                    "model": self.model,
-                    "messages": messages,
-                    "temperature": 0.7
-                }) as response:
-                    result = await response.json()
-                    return result['choices'][0]['message']['content']
+            async with client_manager.session.post(self.endpoint, json={
+                "model": self.model,
+                "messages": messages,
+                "temperature": 0.7
+            }) as response:
+                # Raise on error statuses so they are told apart from outages
+                response.raise_for_status()
+                result = await response.json()
+                return result['choices'][0]['message']['content']
         except Exception as e:
-            return f"Llama generation error: {str(e)}"
+            raise _upstream_error(f"Llama generation error: {str(e)}", e) from e
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        messages = self.context.chat_messages(text, session_memory, sentiment)
+
+        try:
+            # OpenAI-compatible servers stream server-sent events
+            async with client_manager.session.post(self.endpoint, json={
+                "model": self.model,
+                "messages": messages,
+                "temperature": 0.7,
+                "stream": True
+            }) as response:
+                response.raise_for_status()
+                async for line in response.content:
+                    line = line.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+
+                    payload = line[len('data:'):].strip()
+                    if payload == '[DONE]':
+                        break
+
+                    delta = json.loads(payload)['choices'][0].get('delta', {})
+                    content = delta.get('content')
+                    if content:
+                        yield content
+        except Exception as e:
+            raise _upstream_error(f"Llama generation error: {str(e)}", e) from e
 
     async def analyze_image(self, image_base64: str) -> str:
         try:
-            # Decode base64 image
-            image_data = base64.b64decode(image_base64)
-            
-            # Analyze image (if Llama supports vision)
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.endpoint, json={
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "user", 
-                            "content": "Describe this image in detail.",
-                            "images": [image_data]
-                        }
-                    ]
-                }) as response:
-                    result = await response.json()
-                    return result['choices'][0]['message']['content']
+            # Analyze image (if Llama supports vision) using the OpenAI-compatible format
+            async with client_manager.session.post(self.endpoint, json={
+                "model": self.model,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": "Describe this image in detail."},
+                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+                        ]
+                    }
+                ]
+            }) as response:
+                response.raise_for_status()
+                result = await response.json()
+                return result['choices'][0]['message']['content']
         except Exception as e:
-            return f"Llama image analysis error: {str(e)}"
+            raise _upstream_error(f"Llama image analysis error: {str(e)}", e) from e
@@ -0,0 +1,361 @@
+import os
+import re
+import math
+import time
+import zlib
+import struct
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from conversation_log import UserLog
+
+logger = logging.getLogger(__name__)
+
+Memory = Dict[str, Any]
+
+VECTOR_MAGIC = b'SENTIVEC'
+# Magic, dimension and the embedder's fingerprint; vectors made by a
+# different embedder are rebuilt from the stored texts
+VECTOR_HEADER = struct.Struct('<8sII')
+
+# Rounds of k-means when partitioning a large index
+KMEANS_ITERATIONS = 8
+
+_WORD = re.compile(r'\w+')
+
+STOP_WORDS = frozenset("""
+a about after again all am an and any are as at be because been but by can could did do does doing
+for from had has have having he her here hers him his how i if in into is it its just me more most my
+myself of on or our ours she should so some such than that the their theirs them then there these they
+this those to too was we were what when where which who whom why will with would you your yours
+""".split())
+
+class HashingEmbedder:
+    """Local text embedding: hashed word and word-pair counts, L2-normalized.
+
+    It needs no model and no network call, so adding and searching
+    memories stays in the microseconds. Similar vectors mean shared
+    vocabulary rather than shared meaning, which is enough to bring back
+    earlier conversations about the same people, places and topics. CRC-32
+    is the hash so every process computes the same vectors.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.fingerprint = zlib.crc32(b'hashing-v1')
+
+    def features(self, text: str) -> List[str]:
+        words = [word for word in _WORD.findall(text.lower()) if len(word) > 1 and word not in STOP_WORDS]
+        return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+    def embed(self, texts: List[str]) -> 'np.ndarray':
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                # A sign bit keeps colliding features from always adding up
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+
+        # Repeating a word shouldn't outweigh mentioning another
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).astype(np.float32, copy=False)
+
+class UserMemory:
+    """One user's memories: texts in a UserLog, embeddings in a matrix file.
+
+    Row i of `<path>.vec` is the embedding of record i of the log. Both are
+    append-only and written under one lock, so workers never interleave
+    rows; if a crash leaves them out of step, extra rows are dropped and
+    missing ones re-embedded when the memory is next opened. Searches read
+    the matrix through a memory map and score every row with one matrix
+    product; once it holds `ivf_threshold` rows it is partitioned with
+    k-means and only the `nprobe` partitions closest to the query (plus
+    rows added since) are scored.
+    """
+
+    def __init__(self, path: str, embedder: HashingEmbedder, ivf_threshold: int = 20000, nprobe: int = 16):
+        # Memories are never compacted away, so log records and rows stay aligned
+        self.log = UserLog(path, max_turns=0)
+        self.vector_path = f'{path}.vec'
+        self.lock_path = f'{path}.vec.lock'
+        self.embedder = embedder
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.header = VECTOR_HEADER.pack(VECTOR_MAGIC, embedder.dim, embedder.fingerprint)
+        self.row_bytes = embedder.dim * 4
+
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._vectors = None
+        self._matrix = None
+        # (rows covered, centroids, row ids sorted by partition, partition bounds)
+        self._ivf: Optional[Tuple[int, Any, Any, Any]] = None
+
+    @contextmanager
+    def _exclusive(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _ensure_open(self):
+        if self._vectors is not None:
+            return
+        self._lock_file = open(self.lock_path, 'a+b')
+        self._vectors = open(self.vector_path, 'a+b')
+        with self._exclusive():
+            self._repair()
+
+    def _repair(self):
+        """Make the rows match the log's records."""
+        size = os.fstat(self._vectors.fileno()).st_size
+        self._vectors.seek(0)
+        if self._vectors.read(VECTOR_HEADER.size) != self.header:
+            if size:
+                logger.info(f"Re-embedding memories in {self.vector_path}")
+            self._vectors.truncate(0)
+            self._vectors.write(self.header)
+            rows = 0
+        else:
+            rows = (size - VECTOR_HEADER.size) // self.row_bytes
+
+        records = len(self.log)
+        rows = min(rows, records)
+        self._vectors.truncate(VECTOR_HEADER.size + rows * self.row_bytes)
+        for start in range(rows, records, 1024):
+            memories = self.log.read(start, start + 1024)
+            self._vectors.write(self.embedder.embed([memory['user'] for memory in memories]).tobytes())
+        self._vectors.flush()
+
+    def _rows(self) -> 'np.ndarray':
+        rows = (os.fstat(self._vectors.fileno()).st_size - VECTOR_HEADER.size) // self.row_bytes
+        if self._matrix is None or len(self._matrix) != rows:
+            if rows:
+                self._matrix = np.memmap(
+                    self.vector_path, dtype=np.float32, mode='r',
+                    offset=VECTOR_HEADER.size, shape=(rows, self.embedder.dim)
+                )
+            else:
+                self._matrix = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        return self._matrix
+
+    def add(self, memories: List[Memory]):
+        vectors = self.embedder.embed([memory['user'] for memory in memories])
+        with self._lock:
+            self._ensure_open()
+            with self._exclusive():
+                self.log.append(memories)
+                self._vectors.write(vectors.tobytes())
+                self._vectors.flush()
+
+    def _partition(self, matrix: 'np.ndarray'):
+        """Spherical k-means over the rows, about sqrt(n) partitions."""
+        vectors = np.asarray(matrix)
+        lists = max(1, int(math.sqrt(len(vectors))))
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Partitions that lost all their rows keep their old centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(lists + 1))
+        self._ivf = (len(vectors), centroids, order, bounds)
+
+    def _candidates(self, matrix: 'np.ndarray', query: 'np.ndarray') -> Optional['np.ndarray']:
+        """Rows worth scoring for `query`, or None to score them all."""
+        if len(matrix) < self.ivf_threshold:
+            return None
+        # Re-partition once rows added since the last time would cost too much to scan
+        if self._ivf is None or len(matrix) - self._ivf[0] > self._ivf[0] // 2:
+            self._partition(matrix)
+
+        covered, centroids, order, bounds = self._ivf
+        nprobe = min(self.nprobe, len(centroids))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        parts = [order[bounds[c]:bounds[c + 1]] for c in probe]
+        parts.append(np.arange(covered, len(matrix)))
+        return np.concatenate(parts)
+
+    def search(self, query: 'np.ndarray', k: int) -> List[Tuple[float, Memory]]:
+        """The `k` memories most similar to an embedded query, best first."""
+        with self._lock:
+            self._ensure_open()
+            matrix = self._rows()
+            if not len(matrix) or k <= 0:
+                return []
+
+            candidates = self._candidates(matrix, query)
+            if candidates is None:
+                scores = matrix @ query
+                ids = np.arange(len(matrix))
+            else:
+                scores = matrix[candidates] @ query
+                ids = candidates
+
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return [(float(scores[i]), self.log.read(int(ids[i]), int(ids[i]) + 1)[0]) for i in top]
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            self._ivf = None
+            for name in ('_vectors', '_lock_file'):
+                resource = getattr(self, name)
+                if resource is not None:
+                    resource.close()
+                    setattr(self, name, None)
+        self.log.close()
+
+def format_memories(memories: List[Memory], max_chars: int = 300) -> str:
+    """Recalled memories as a note for the prompt."""
+    def clip(text: str) -> str:
+        return text if len(text) <= max_chars else text[:max_chars].rstrip() + '...'
+
+    lines = [
+        f"- The user said: {clip(memory['user'])}\n  You replied: {clip(memory['assistant'])}"
+        for memory in memories
+    ]
+    return "Relevant moments from earlier conversations with this user:\n" + "\n".join(lines)
+
+class MemoryIndex:
+    """Long-term memory: each user's past exchanges, searchable by similarity.
+
+    Every exchange is stored under the user's key; before a reply, the
+    `top_k` past exchanges most similar to the new message (and at least
+    `min_score` similar) are recalled, so the prompt carries a bounded
+    number of memories however long the relationship has run. The
+    `max_open` most recently used users are kept open. Embedding and
+    search run in a worker thread.
+    """
+
+    def __init__(
+        self,
+        directory: str = 'memories',
+        dim: int = 256,
+        top_k: int = 3,
+        min_score: float = 0.2,
+        max_open: int = 128,
+        ivf_threshold: int = 20000,
+        nprobe: int = 16
+    ):
+        if np is None:
+            raise RuntimeError("The memory index requires numpy")
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.embedder = HashingEmbedder(dim)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.max_open = max_open
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._users: 'OrderedDict[str, UserMemory]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.added = 0
+        self.searches = 0
+        self.recalled = 0
+
+    def memory(self, user_id: str) -> UserMemory:
+        """The user's memory, opening it if needed and closing the least recently used."""
+        key = hashlib.sha256(user_id.encode('utf-8')).hexdigest()[:32]
+        evicted = []
+        with self._lock:
+            memory = self._users.get(key)
+            if memory is None:
+                memory = UserMemory(
+                    os.path.join(self.directory, key), self.embedder, self.ivf_threshold, self.nprobe
+                )
+                self._users[key] = memory
+            self._users.move_to_end(key)
+            while len(self._users) > self.max_open:
+                evicted.append(self._users.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return memory
+
+    async def add(self, user_id: str, text: str, response: str):
+        """Remember one exchange."""
+        memory = {"user": text, "assistant": response, "ts": time.time()}
+        await asyncio.to_thread(self.memory(user_id).add, [memory])
+        self.added += 1
+
+    def _recall(self, user_id: str, text: str, exclude: Iterable[str]) -> List[Memory]:
+        query = self.embedder.embed([text])[0]
+        if not query.any():
+            return []
+        exclude = set(exclude)
+        # Over-fetch so excluded memories don't leave the prompt short
+        results = self.memory(user_id).search(query, self.top_k + len(exclude))
+        return [
+            memory for score, memory in results
+            if score >= self.min_score and memory['user'] not in exclude
+        ][:self.top_k]
+
+    async def search(self, user_id: str, text: str, exclude: Iterable[str] = ()) -> List[Memory]:
+        """Past exchanges relevant to `text`, best first, skipping user messages in `exclude`."""
+        memories = await asyncio.to_thread(self._recall, user_id, text, list(exclude))
+        self.searches += 1
+        self.recalled += len(memories)
+        return memories
+
+    def close(self):
+        with self._lock:
+            users = list(self._users.values())
+            self._users.clear()
+        for memory in users:
+            memory.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open_users": len(self._users),
+            "added": self.added,
+            "searches": self.searches,
+            "recalled": self.recalled
+        }
+
+def create_memory_index() -> Optional[MemoryIndex]:
+    """Build the memory index from the MEMORY_* environment variables, if enabled."""
+    if os.getenv('MEMORY_INDEX', 'false').lower() != 'true':
+        return None
+    if np is None:
+        logger.warning("MEMORY_INDEX needs numpy; leaving it off")
+        return None
+
+    return MemoryIndex(
+        directory=os.getenv('MEMORY_DIR', 'memories'),
+        dim=int(os.getenv('MEMORY_DIM', '256')),
+        top_k=int(os.getenv('MEMORY_TOP_K', '3')),
+        min_score=float(os.getenv('MEMORY_MIN_SCORE', '0.2')),
+        max_open=int(os.getenv('MEMORY_MAX_OPEN', '128')),
+        ivf_threshold=int(os.getenv('MEMORY_IVF_THRESHOLD', '20000')),
+        nprobe=int(os.getenv('MEMORY_IVF_NPROBE', '16'))
+    )
@@ -0,0 +1,113 @@
+from typing import List, Dict, Any, Optional, Union, Literal, Annotated
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
+
+from wire_protocol import ProtocolError
+
+class InvalidMessage(ProtocolError):
+    """Raised when a decoded frame doesn't match any message schema."""
+
+class UnknownMessage(InvalidMessage):
+    """Raised for frame types the server doesn't handle (ignored, as clients add new ones)."""
+
+class Message(BaseModel):
+    # Clients send extra keys (platform, broadcast, ...) that no handler reads
+    model_config = ConfigDict(extra='ignore')
+
+# Bounds on client-sent history; the server trims it to the prompt budget anyway
+MAX_HISTORY_TURNS = 100
+MAX_TURN_LENGTH = 16000
+
+class HistoryTurn(Message):
+    role: Literal['user', 'assistant', 'system']
+    content: str = Field(max_length=MAX_TURN_LENGTH)
+
+class ChatMessage(Message):
+    """A user turn. `stream` frames are chat turns that always stream."""
+
+    # chat_message is what the `/` client sends; untyped frames are chat too
+    type: Literal['chat', 'chat_message', 'stream']
+    message: str = Field(min_length=1)
+    # Older clients name the provider in `model`
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    stream: bool = False
+    # Client-side history from older clients; otherwise the server's is used
+    history: Optional[List[HistoryTurn]] = Field(default=None, max_length=MAX_HISTORY_TURNS)
+    hedge: Union[bool, str, None] = None
+    hedge_providers: Optional[List[str]] = None
+    concurrent: bool = False
+    turn_id: Optional[str] = None
+    # Signed by whoever authenticates users; see identity.py
+    user_token: Optional[str] = None
+    session_id: Optional[str] = None
+
+class ImageMessage(Message):
+    type: Literal['image', 'image_message']
+    # base64 text, or raw bytes in MessagePack frames
+    image: Union[str, bytes] = Field(min_length=1)
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    turn_id: Optional[str] = None
+
+class CancelMessage(Message):
+    """Cancel one turn, or every turn in flight if `turn_id` is omitted."""
+
+    type: Literal['cancel']
+    turn_id: Optional[str] = None
+
+class ResumeMessage(Message):
+    type: Literal['resume']
+    session_id: str = Field(min_length=1)
+
+class PingMessage(Message):
+    type: Literal['ping']
+
+class ConnectMessage(Message):
+    """Sent by clients right after connecting to announce their platform."""
+
+    type: Literal['connect']
+    platform: Optional[str] = None
+    user_token: Optional[str] = None
+
+class ChangeModelMessage(Message):
+    """Selects the provider for this connection's later turns."""
+
+    type: Literal['change_model']
+    model: str = Field(min_length=1)
+
+class SentimentMessage(Message):
+    """Asks for the sentiment of a text; the client's own guess is ignored."""
+
+    type: Literal['sentiment_analysis']
+    text: str
+
+AnyMessage = Annotated[
+    Union[
+        ChatMessage,
+        ImageMessage,
+        CancelMessage,
+        ResumeMessage,
+        PingMessage,
+        ConnectMessage,
+        ChangeModelMessage,
+        SentimentMessage
+    ],
+    Field(discriminator='type')
+]
+
+# Built once: validation runs the compiled schema, dispatching on `type`
+_adapter = TypeAdapter(AnyMessage)
+
+def parse_message(data: Dict[str, Any]) -> Message:
+    """Validate a decoded frame into its typed message."""
+    if 'type' not in data:
+        data = {**data, 'type': 'chat'}
+    try:
+        return _adapter.validate_python(data)
+    except ValidationError as e:
+        error = e.errors(include_url=False, include_input=False)[0]
+        if error['type'] == 'union_tag_invalid':
+            raise UnknownMessage(f"Unknown message type: {data.get('type')}")
+        location = '.'.join(str(part) for part in error['loc'][1:]) or 'type'
+        raise InvalidMessage(f"Invalid {data.get('type')} message: {location}: {error['msg']}")
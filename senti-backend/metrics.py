@@ -0,0 +1,229 @@
+import os
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Callable, Iterator, Tuple
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        # HELP/TYPE name the family as its samples do, like prometheus_client
+        name = f"{self.name}_total"
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Gauge:
+    """A gauge that is either set directly or read from a callback at scrape time."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Optional[Callable[[], float]] = None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> List[str]:
+        value = self.callback() if self.callback else self.value
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {value}"
+        ]
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: [per-bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None) -> Gauge:
+        """Register (or re-point) a gauge; apps attach their own callbacks."""
+        existing = self._metrics.get(name)
+        if isinstance(existing, Gauge):
+            existing.callback = callback
+            return existing
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+PROVIDER_CALL_SECONDS = registry.register(Histogram(
+    'senti_provider_call_seconds',
+    'Duration of upstream LLM provider calls.',
+    ('provider', 'method', 'outcome')
+))
+TIME_TO_FIRST_TOKEN_SECONDS = registry.register(Histogram(
+    'senti_time_to_first_token_seconds',
+    'Time from request to first streamed chunk per provider.',
+    ('provider',)
+))
+FRAME_DECODE_SECONDS = registry.register(Histogram(
+    'senti_frame_decode_seconds',
+    'Time spent parsing incoming websocket frames.',
+    ('format',),
+    FAST_BUCKETS
+))
+FRAME_ENCODE_SECONDS = registry.register(Histogram(
+    'senti_frame_encode_seconds',
+    'Time spent serializing outgoing websocket frames.',
+    ('format',),
+    FAST_BUCKETS
+))
+CHAT_TURN_SECONDS = registry.register(Histogram(
+    'senti_chat_turn_seconds',
+    'End-to-end duration of a chat turn.',
+    ('endpoint', 'stream')
+))
+EVENT_LOOP_LAG_SECONDS = registry.register(Histogram(
+    'senti_event_loop_lag_seconds',
+    'How late the event loop ran a scheduled wake-up.',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+))
+OUTBOUND_QUEUE_DEPTH = registry.register(Histogram(
+    'senti_outbound_queue_depth',
+    'Frames already waiting when a frame is queued for a websocket.',
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+))
+OUTBOUND_FRAMES = registry.register(Counter(
+    'senti_outbound_frames',
+    'Outbound websocket frames by outcome (sent, coalesced, dropped).',
+    ('outcome',)
+))
+ADMISSION_WAIT_SECONDS = registry.register(Histogram(
+    'senti_admission_wait_seconds',
+    'Time a turn waited for a generation slot.'
+))
+ADMISSION_REJECTIONS = registry.register(Counter(
+    'senti_admission_rejections',
+    'Turns refused with a busy response, by reason.',
+    ('reason',)
+))
+
+class LoopLagMonitor:
+    """Samples event-loop lag by timing how late a periodic sleep wakes up."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - self.interval))
+
+loop_lag_monitor = LoopLagMonitor(float(os.getenv('LOOP_LAG_INTERVAL', '0.5')))
+
+_tracer = trace.get_tracer('senti') if trace is not None else None
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    """An OpenTelemetry span when opentelemetry is installed, otherwise a no-op."""
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        yield
@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Any, Deque, Union
+
+from fastapi import WebSocketDisconnect
+
+from metrics import registry, OUTBOUND_QUEUE_DEPTH, OUTBOUND_FRAMES
+
+logger = logging.getLogger(__name__)
+
+Frame = Union[Dict[str, Any], str]
+
+# Close code for a client that can't keep up ("try again later")
+OVERLOAD_CLOSE_CODE = 1013
+
+# Frames that end a turn; a client waiting on one would hang if it were dropped
+TERMINAL_TYPES = {'chat_response', 'image_response', 'error', 'cancelled', 'busy'}
+
+class OutboundQueue:
+    """Bounded per-connection send queue drained by a dedicated writer task.
+
+    `send_json` and `send_text` only enqueue, so a slow reader never stalls
+    the upstream stream feeding it. While the writer is behind, consecutive
+    stream chunks are merged into a single frame. Once `max_frames` frames
+    are waiting the `policy` applies: 'close' disconnects the client,
+    'drop' discards the new frame unless it ends a turn. Everything else is delegated to the
+    wrapped socket.
+    """
+
+    # Live queues, for the queue-depth gauge and /status
+    queues = set()
+    coalesced = 0
+    dropped = 0
+    overflows = 0
+
+    def __init__(self, websocket, max_frames: int = 64, policy: str = 'close'):
+        self.websocket = websocket
+        self.max_frames = max_frames
+        self.policy = policy
+        self.closed = False
+
+        self._frames: Deque[Frame] = deque()
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write())
+        OutboundQueue.queues.add(self)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.websocket, name)
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    async def send_json(self, data: Dict[str, Any]):
+        self._enqueue(data)
+
+    async def send_text(self, text: str):
+        self._enqueue(text)
+
+    def _enqueue(self, frame: Frame):
+        if self.closed:
+            raise WebSocketDisconnect(OVERLOAD_CLOSE_CODE)
+
+        OUTBOUND_QUEUE_DEPTH.observe(len(self._frames))
+        if self._frames and self._coalesce(self._frames[-1], frame):
+            OutboundQueue.coalesced += 1
+            OUTBOUND_FRAMES.inc(outcome='coalesced')
+            return
+
+        if len(self._frames) >= self.max_frames:
+            OutboundQueue.overflows += 1
+            if self.policy == 'drop' and self._is_terminal(frame):
+                # Queued past the limit; there is at most one per turn
+                self._frames.append(frame)
+                self._ready.set()
+                return
+            if self.policy == 'drop':
+                OutboundQueue.dropped += 1
+                OUTBOUND_FRAMES.inc(outcome='dropped')
+                logger.warning("Outbound queue full, dropping frame")
+                return
+            logger.warning("Outbound queue full, closing slow connection")
+            self._abort()
+            raise WebSocketDisconnect(OVERLOAD_CLOSE_CODE)
+
+        self._frames.append(frame)
+        self._ready.set()
+
+    @staticmethod
+    def _is_terminal(frame: Frame) -> bool:
+        if isinstance(frame, str):
+            # Pre-encoded frames (e.g. routed from another worker) are only
+            # parsed here, once the queue is already full
+            try:
+                frame = json.loads(frame)
+            except ValueError:
+                return False
+            if not isinstance(frame, dict):
+                return False
+        return bool(frame.get('done')) or frame.get('type') in TERMINAL_TYPES
+
+    @staticmethod
+    def _coalesce(last: Frame, frame: Frame) -> bool:
+        """Merge a stream chunk into a queued one with the same metadata."""
+        if not (isinstance(last, dict) and isinstance(frame, dict)):
+            return False
+        if last.get('type') != 'stream' or frame.get('type') != 'stream':
+            return False
+        if last.get('done') or frame.get('done') or last.keys() != frame.keys():
+            return False
+        if any(last[key] != frame[key] for key in last if key != 'content'):
+            return False
+        last['content'] += frame['content']
+        return True
+
+    async def _write(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self._frames:
+                    frame = self._frames.popleft()
+                    if isinstance(frame, str):
+                        await self.websocket.send_text(frame)
+                    else:
+                        await self.websocket.send_json(frame)
+                    OUTBOUND_FRAMES.inc(outcome='sent')
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The reader's next receive surfaces the disconnect
+            logger.debug(f"Outbound writer stopped: {str(e)}")
+            self.closed = True
+            self._frames.clear()
+
+    def _abort(self):
+        self.closed = True
+        self._frames.clear()
+        self._writer.cancel()
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=OVERLOAD_CLOSE_CODE)
+        except Exception as e:
+            logger.debug(f"Error closing slow connection: {str(e)}")
+
+    async def stop(self):
+        """Stop the writer; queued frames are discarded."""
+        self.closed = True
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        OutboundQueue.queues.discard(self)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        depths = [queue.depth for queue in cls.queues]
+        return {
+            "connections": len(depths),
+            "queued_frames": sum(depths),
+            "max_depth": max(depths, default=0),
+            "coalesced": cls.coalesced,
+            "dropped": cls.dropped,
+            "overflows": cls.overflows
+        }
+
+registry.gauge(
+    'senti_outbound_queued_frames',
+    'Frames waiting in outbound websocket queues.',
+    lambda: sum(queue.depth for queue in OutboundQueue.queues)
+)
+
+def create_outbound_queue(websocket) -> OutboundQueue:
+    """Wrap a socket in an OutboundQueue configured from OUTBOUND_* variables."""
+    return OutboundQueue(
+        websocket,
+        max_frames=int(os.getenv('OUTBOUND_MAX_FRAMES', '64')),
+        policy=os.getenv('OUTBOUND_POLICY', 'close')
+    )
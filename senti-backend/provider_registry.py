@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, AsyncIterator, Type
+
+from llm_providers import (
+    BaseLLMProvider,
+    GeminiProvider,
+    OpenAIProvider,
+    OllamaProvider,
+    LlamaProvider
+)
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_CLASSES: Dict[str, Type[BaseLLMProvider]] = {
+    'gemini': GeminiProvider,
+    'openai': OpenAIProvider,
+    'ollama': OllamaProvider,
+    'llama': LlamaProvider
+}
+
+class LazyProvider(BaseLLMProvider):
+    """Stands in for a provider and constructs it, importing its SDK, on first use."""
+
+    def __init__(self, name: str, provider_class: Type[BaseLLMProvider]):
+        self.name = name
+        self.provider_class = provider_class
+        # Known up front so wrappers (cache, router) don't force construction
+        self.model = provider_class.configured_model()
+        self._provider: Optional[BaseLLMProvider] = None
+
+    @property
+    def initialized(self) -> bool:
+        return self._provider is not None
+
+    @property
+    def provider(self) -> BaseLLMProvider:
+        if self._provider is None:
+            start = time.perf_counter()
+            self._provider = self.provider_class()
+            logger.info(f"Initialized {self.name} provider in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return self._provider
+
+    async def generate_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> str:
+        return await self.provider.generate_response(text, session_memory, sentiment)
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        async for chunk in self.provider.stream_response(text, session_memory, sentiment):
+            yield chunk
+
+    async def analyze_image(self, image_base64: str) -> str:
+        return await self.provider.analyze_image(image_base64)
+
+    async def embed(self, text: str) -> List[float]:
+        return await self.provider.embed(text)
+
+    async def warm_up(self):
+        await self.provider.warm_up()
+
+class ProviderRegistry:
+    """The enabled providers, each initialized lazily."""
+
+    def __init__(self, names: List[str], default: Optional[str] = None):
+        self.providers: Dict[str, LazyProvider] = {
+            name: LazyProvider(name, PROVIDER_CLASSES[name]) for name in names
+        }
+        if not self.providers:
+            raise ValueError("At least one provider must be enabled")
+        self.default = default if default in self.providers else next(iter(self.providers))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.providers
+
+    def get(self, name: str) -> LazyProvider:
+        return self.providers[name]
+
+    async def warm_up(self, names: List[str], timeout: float = 5):
+        """Initialize providers and open their connections before traffic arrives.
+
+        Failures are logged, never raised: a cold provider still works.
+        """
+        async def warm(name: str):
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.providers[name].warm_up(), timeout)
+                logger.info(f"Warmed up {name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+            except Exception as e:
+                logger.warning(f"Warm-up of {name} failed: {str(e) or type(e).__name__}")
+
+        await asyncio.gather(*[warm(name) for name in names if name in self.providers])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {"model": provider.model, "initialized": provider.initialized}
+            for name, provider in self.providers.items()
+        }
+
+def _names(value: str) -> List[str]:
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+def create_provider_registry() -> ProviderRegistry:
+    """Build the registry from ENABLED_PROVIDERS and DEFAULT_PROVIDER."""
+    names = []
+    for name in _names(os.getenv('ENABLED_PROVIDERS', 'gemini,openai,ollama,llama')):
+        if name in PROVIDER_CLASSES:
+            names.append(name)
+        else:
+            logger.warning(f"Unknown provider in ENABLED_PROVIDERS: {name}")
+    return ProviderRegistry(names, os.getenv('DEFAULT_PROVIDER', 'gemini'))
+
+async def warm_up_providers(registry: ProviderRegistry):
+    """Startup hook: warm the providers listed in PROVIDER_WARMUP."""
+    names = _names(os.getenv('PROVIDER_WARMUP', ''))
+    if names:
+        await registry.warm_up(names, float(os.getenv('PROVIDER_WARMUP_TIMEOUT', '5')))
@@ -0,0 +1,395 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable
+
+from llm_providers import BaseLLMProvider, ProviderError, ProviderInputError
+from metrics import PROVIDER_CALL_SECONDS, TIME_TO_FIRST_TOKEN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# The provider that produced the latest reply in this context, so wrappers
+# (e.g. the response cache) can tell a failover reply from the primary's
+answered_by: ContextVar[Optional[str]] = ContextVar('answered_by', default=None)
+
+class CircuitBreaker:
+    """Stops calling a provider after repeated failures, then probes it again."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state != 'half_open':
+            return state == 'closed'
+        # Half-open admits one probe, whose result decides the state; a probe
+        # that never reported back (e.g. it was cancelled) is replaced in time
+        now = time.monotonic()
+        if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+            return False
+        self.probe_started = now
+        return True
+
+    def release_probe(self):
+        """End an attempt that says nothing about the provider's health."""
+        self.probe_started = None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probe_started = None
+
+class ProviderStats:
+    """Call counts and rolling windows of latencies for one provider."""
+
+    def __init__(self, window: int = 200):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        # Attempts that found every slot taken for the whole deadline
+        self.saturated = 0
+        self.in_flight = 0
+        # Full call durations, and time-to-first-token of streams, kept
+        # apart so one never skews percentiles of the other
+        self.latencies = deque(maxlen=window)
+        self.ttft = deque(maxlen=window)
+
+    @staticmethod
+    def _percentile(values, pct: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def percentile(self, pct: float) -> Optional[float]:
+        return self._percentile(self.latencies, pct)
+
+    def ttft_percentile(self, pct: float) -> Optional[float]:
+        return self._percentile(self.ttft, pct)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "saturated": self.saturated,
+            "in_flight": self.in_flight,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "ttft_p95": self.ttft_percentile(95)
+        }
+
+class ProviderRouter:
+    """Bounded, deadline-aware access to providers with retries and failover."""
+
+    def __init__(
+        self,
+        providers: Dict[str, BaseLLMProvider],
+        fallback_chain: Optional[List[str]] = None,
+        max_concurrency: int = 16,
+        timeout: float = 60,
+        request_timeout: float = 90,
+        retries: int = 2,
+        backoff: float = 0.5,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30
+    ):
+        self.providers = providers
+        self.fallback_chain = [name for name in (fallback_chain or []) if name in providers]
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.semaphores = {name: asyncio.Semaphore(max_concurrency) for name in providers}
+        self.breakers = {name: CircuitBreaker(failure_threshold, reset_timeout) for name in providers}
+        self.stats_by_provider = {name: ProviderStats() for name in providers}
+
+    def chain(self, primary: str, failover: bool = True) -> List[str]:
+        """The requested provider first, then the configured fallbacks."""
+        if primary not in self.providers:
+            primary = next(iter(self.providers))
+        if not failover:
+            return [primary]
+        return [primary] + [name for name in self.fallback_chain if name != primary]
+
+    def provider(self, name: str, failover: bool = True) -> 'RoutedProvider':
+        return RoutedProvider(self, name, failover)
+
+    def ttft_p95(self, name: str) -> Optional[float]:
+        """Observed p95 time-to-first-token of a provider's streams."""
+        return self.stats_by_provider[name].ttft_percentile(95)
+
+    async def _backoff(self, attempt: int, deadline: float):
+        # Exponential backoff with jitter so retries don't arrive in lockstep
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        await asyncio.sleep(max(0.0, min(delay, deadline - time.monotonic())))
+
+    async def _acquire(self, name: str, timeout: float) -> bool:
+        """Take one of the provider's slots, waiting at most `timeout`."""
+        try:
+            await asyncio.wait_for(self.semaphores[name].acquire(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def call(
+        self,
+        primary: str,
+        fn: Callable[[BaseLLMProvider], Awaitable[Any]],
+        failover: bool = True,
+        method: str = 'generate_response'
+    ) -> Any:
+        """Run `fn` against the chain until one provider succeeds.
+
+        Each attempt (waiting for a slot included) gets `timeout`; the whole
+        request, across retries and fallbacks, gets `request_timeout`.
+        """
+        deadline = time.monotonic() + self.request_timeout
+        errors = []
+        for name in self.chain(primary, failover):
+            breaker = self.breakers[name]
+            stats = self.stats_by_provider[name]
+
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    errors.append(f"request deadline of {self.request_timeout}s exceeded")
+                    raise ProviderError(f"All providers failed: {'; '.join(errors)}")
+                if not breaker.allow():
+                    errors.append(f"{name}: circuit open")
+                    break
+
+                timeout = min(self.timeout, remaining)
+                start = time.monotonic()
+                stats.calls += 1
+                stats.in_flight += 1
+                try:
+                    if not await self._acquire(name, timeout):
+                        # Saturated: retrying would only queue again, so fail over
+                        stats.saturated += 1
+                        breaker.record_failure()
+                        PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method=method, outcome='saturated')
+                        errors.append(f"{name}: no free slot within {timeout:.1f}s")
+                        break
+                    try:
+                        result = await asyncio.wait_for(
+                            fn(self.providers[name]), timeout - (time.monotonic() - start)
+                        )
+                    finally:
+                        self.semaphores[name].release()
+                    elapsed = time.monotonic() - start
+                    stats.latencies.append(elapsed)
+                    PROVIDER_CALL_SECONDS.observe(elapsed, provider=name, method=method, outcome='ok')
+                    breaker.record_success()
+                    answered_by.set(name)
+                    return result
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                    breaker.record_failure()
+                    PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method=method, outcome='timeout')
+                    errors.append(f"{name}: timed out after {timeout:.1f}s")
+                except ProviderInputError:
+                    # The request itself is bad; no other attempt would do better
+                    breaker.release_probe()
+                    PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method=method, outcome='rejected')
+                    raise
+                except ProviderError as e:
+                    stats.errors += 1
+                    breaker.record_failure()
+                    PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method=method, outcome='error')
+                    errors.append(str(e))
+                except Exception:
+                    # A bug on our side, not an upstream failure
+                    breaker.release_probe()
+                    raise
+                finally:
+                    stats.in_flight -= 1
+
+                if attempt < self.retries:
+                    await self._backoff(attempt, deadline)
+
+            logger.warning(f"Provider {name} failed: {errors[-1]}")
+
+        raise ProviderError(f"All providers failed: {'; '.join(errors)}")
+
+    async def stream(
+        self,
+        primary: str,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None,
+        failover: bool = True
+    ) -> AsyncIterator[str]:
+        """Stream from the first healthy provider.
+
+        Failover is only possible until the first chunk has been sent, so
+        the request deadline applies until then; after it, each gap between
+        chunks gets `timeout`.
+        """
+        deadline = time.monotonic() + self.request_timeout
+        errors = []
+        for name in self.chain(primary, failover):
+            breaker = self.breakers[name]
+            stats = self.stats_by_provider[name]
+
+            for attempt in range(self.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    errors.append(f"request deadline of {self.request_timeout}s exceeded")
+                    raise ProviderError(f"All providers failed: {'; '.join(errors)}")
+                if not breaker.allow():
+                    errors.append(f"{name}: circuit open")
+                    break
+
+                timeout = min(self.timeout, remaining)
+                started = False
+                start = time.monotonic()
+                stats.calls += 1
+                stats.in_flight += 1
+                try:
+                    if not await self._acquire(name, timeout):
+                        stats.saturated += 1
+                        breaker.record_failure()
+                        PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method='stream_response', outcome='saturated')
+                        errors.append(f"{name}: no free slot within {timeout:.1f}s")
+                        break
+                    try:
+                        chunks = self.providers[name].stream_response(text, session_memory, sentiment)
+                        try:
+                            while True:
+                                gap = self.timeout if started else timeout - (time.monotonic() - start)
+                                try:
+                                    chunk = await asyncio.wait_for(chunks.__anext__(), gap)
+                                except StopAsyncIteration:
+                                    break
+                                if not started:
+                                    ttft = time.monotonic() - start
+                                    stats.ttft.append(ttft)
+                                    TIME_TO_FIRST_TOKEN_SECONDS.observe(ttft, provider=name)
+                                    answered_by.set(name)
+                                    started = True
+                                yield chunk
+                        finally:
+                            await chunks.aclose()
+                    finally:
+                        self.semaphores[name].release()
+                    elapsed = time.monotonic() - start
+                    stats.latencies.append(elapsed)
+                    PROVIDER_CALL_SECONDS.observe(elapsed, provider=name, method='stream_response', outcome='ok')
+                    breaker.record_success()
+                    return
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                    breaker.record_failure()
+                    PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method='stream_response', outcome='timeout')
+                    if started:
+                        raise ProviderError(f"{name}: stream stalled for {self.timeout}s")
+                    errors.append(f"{name}: timed out after {timeout:.1f}s")
+                except ProviderInputError:
+                    breaker.release_probe()
+                    PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method='stream_response', outcome='rejected')
+                    raise
+                except ProviderError as e:
+                    stats.errors += 1
+                    breaker.record_failure()
+                    PROVIDER_CALL_SECONDS.observe(time.monotonic() - start, provider=name, method='stream_response', outcome='error')
+                    if started:
+                        raise
+                    errors.append(str(e))
+                except Exception:
+                    # A bug on our side, not an upstream failure
+                    breaker.release_probe()
+                    raise
+                finally:
+                    stats.in_flight -= 1
+
+                if attempt < self.retries:
+                    await self._backoff(attempt, deadline)
+
+            logger.warning(f"Provider {name} failed: {errors[-1]}")
+
+        raise ProviderError(f"All providers failed: {'; '.join(errors)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {**stats.to_dict(), "circuit": self.breakers[name].state}
+            for name, stats in self.stats_by_provider.items()
+        }
+
+class RoutedProvider(BaseLLMProvider):
+    """A provider view whose calls go through the router, starting at `name`."""
+
+    def __init__(self, router: ProviderRouter, name: str, failover: bool = True):
+        self.router = router
+        self.name = name
+        self.failover = failover
+        # Exposed so wrappers (e.g. the response cache) can key on the model
+        self.model = getattr(router.providers.get(name), 'model', '')
+
+    async def generate_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> str:
+        return await self.router.call(
+            self.name,
+            lambda provider: provider.generate_response(text, session_memory, sentiment),
+            self.failover
+        )
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        async for chunk in self.router.stream(self.name, text, session_memory, sentiment, self.failover):
+            yield chunk
+
+    async def analyze_image(self, image_base64: str) -> str:
+        return await self.router.call(
+            self.name,
+            lambda provider: provider.analyze_image(image_base64),
+            self.failover,
+            method='analyze_image'
+        )
+
+def create_provider_router(providers: Dict[str, BaseLLMProvider]) -> ProviderRouter:
+    """Build a router from the PROVIDER_* environment variables."""
+    chain = os.getenv('PROVIDER_FALLBACK_CHAIN', 'gemini,openai,ollama')
+    return ProviderRouter(
+        providers,
+        fallback_chain=[name.strip() for name in chain.split(',') if name.strip()],
+        max_concurrency=int(os.getenv('PROVIDER_MAX_CONCURRENCY', '16')),
+        timeout=float(os.getenv('PROVIDER_TIMEOUT', '60')),
+        request_timeout=float(os.getenv('PROVIDER_REQUEST_TIMEOUT', '90')),
+        retries=int(os.getenv('PROVIDER_RETRIES', '2')),
+        backoff=float(os.getenv('PROVIDER_BACKOFF', '0.5')),
+        failure_threshold=int(os.getenv('PROVIDER_CIRCUIT_FAILURES', '5')),
+        reset_timeout=float(os.getenv('PROVIDER_CIRCUIT_RESET', '30'))
+    )
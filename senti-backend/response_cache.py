@@ -0,0 +1,295 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from llm_providers import BaseLLMProvider
+from provider_router import answered_by
+
+logger = logging.getLogger(__name__)
+
+Embedder = Callable[[str], Awaitable[List[float]]]
+
+def normalize_prompt(text: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt."""
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+def context_hash(
+    session_memory: Optional[List[Dict[str, Any]]] = None,
+    sentiment: Optional[Dict[str, Any]] = None
+) -> str:
+    """Stable hash of everything besides the prompt that shapes a response."""
+    payload = json.dumps(
+        {"memory": session_memory or [], "sentiment": sentiment or {}},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+@dataclass
+class CacheEntry:
+    response: str
+    scope: str
+    expires_at: float
+    size: int
+    # Row of the entry's embedding in ResponseCache._vectors
+    row: Optional[int] = None
+
+class ResponseCache:
+    """TTL + LRU cache of provider responses with a memory cap.
+
+    With an embedder, prompts are also matched by similarity. Embeddings are
+    kept as unit rows of one matrix, so a lookup is a single matrix-vector
+    product instead of a Python loop over every entry.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_entries: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+        embedder: Optional[Embedder] = None,
+        similarity_threshold: float = 0.95,
+        embed_timeout: float = 0.2
+    ):
+        if embedder is not None and np is None:
+            logger.warning("Semantic response caching needs numpy; matching exact prompts only")
+            embedder = None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.embed_timeout = embed_timeout
+
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._bytes = 0
+        # Allocated once the embedding size is known; free rows are zero
+        self._vectors: Optional['np.ndarray'] = None
+        self._row_keys: List[Optional[str]] = [None] * max_entries
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def scope(provider: str, model: str, ctx_hash: str) -> str:
+        return f"{provider}:{model}:{ctx_hash}"
+
+    @staticmethod
+    def key(scope: str, prompt: str) -> str:
+        return hashlib.sha256(f"{scope}\n{normalize_prompt(prompt)}".encode('utf-8')).hexdigest()
+
+    async def get(self, scope: str, prompt: str) -> Tuple[Optional[str], Optional[asyncio.Future]]:
+        """Exact lookup first, then embedding similarity within the same scope.
+
+        Returns the cached response, if any, and on a miss the prompt's
+        pending embedding to hand to put(), so the prompt is embedded once.
+        The similarity lookup waits at most `embed_timeout` for the
+        embedding; generation shouldn't wait on a slow embedding call.
+        """
+        now = time.monotonic()
+        key = self.key(scope, prompt)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.response, None
+            self._remove(key)
+
+        embedding = None
+        if self.embedder is not None:
+            embedding = asyncio.ensure_future(self._embed(prompt))
+            await asyncio.wait({embedding}, timeout=self.embed_timeout)
+            if embedding.done() and embedding.result() is not None:
+                match = self._semantic_lookup(scope, embedding.result(), now)
+                if match is not None:
+                    self.semantic_hits += 1
+                    return match, None
+
+        self.misses += 1
+        return None, embedding
+
+    async def put(
+        self,
+        scope: str,
+        prompt: str,
+        response: str,
+        embedding: Optional[Awaitable[Optional['np.ndarray']]] = None
+    ):
+        if not response:
+            return
+
+        vector = None
+        if self.embedder is not None:
+            vector = await (embedding if embedding is not None else self._embed(prompt))
+            if vector is not None and self._vectors is not None and vector.shape[0] != self._vectors.shape[1]:
+                # The embedding model changed; keep matching the old size only
+                vector = None
+
+        key = self.key(scope, prompt)
+        if key in self._entries:
+            self._remove(key)
+
+        size = len(response.encode('utf-8')) + (vector.nbytes if vector is not None else 0)
+        if size > self.max_bytes:
+            return
+
+        # Evict least recently used entries until the new one fits both limits
+        while self._entries and (
+            len(self._entries) >= self.max_entries or self._bytes + size > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+        row = None
+        if vector is not None:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            row = self._free_rows.pop()
+            self._vectors[row] = vector
+            self._row_keys[row] = key
+
+        self._entries[key] = CacheEntry(
+            response=response,
+            scope=scope,
+            expires_at=time.monotonic() + self.ttl,
+            size=size,
+            row=row
+        )
+        self._bytes += size
+
+    async def _embed(self, prompt: str) -> Optional['np.ndarray']:
+        """Unit-length embedding of the normalized prompt, or None if embedding failed."""
+        try:
+            vector = np.asarray(await self.embedder(normalize_prompt(prompt)), dtype=np.float32)
+        except Exception as e:
+            logger.error(f"Response cache embedding error: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _semantic_lookup(self, scope: str, query: 'np.ndarray', now: float) -> Optional[str]:
+        if self._vectors is None or query.shape[0] != self._vectors.shape[1]:
+            return None
+
+        # Cosine similarity against every entry at once; free rows score 0
+        scores = self._vectors @ query
+        rows = np.flatnonzero(scores >= self.similarity_threshold)
+        for row in rows[np.argsort(-scores[rows])]:
+            key = self._row_keys[row]
+            entry = self._entries[key]
+            if entry.scope == scope and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                return entry.response
+        return None
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if entry.row is not None:
+            self._vectors[entry.row] = 0
+            self._row_keys[entry.row] = None
+            self._free_rows.append(entry.row)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0
+        }
+
+def _model_name(provider: BaseLLMProvider) -> str:
+    model = getattr(provider, 'model', '')
+    # Gemini keeps a GenerativeModel object rather than a name
+    return str(getattr(model, 'model_name', model))
+
+class CachedProvider(BaseLLMProvider):
+    """Serves repeated prompts from a ResponseCache before calling the provider."""
+
+    def __init__(self, provider: BaseLLMProvider, cache: ResponseCache, name: str):
+        self.provider = provider
+        self.cache = cache
+        self.name = name
+        self.model = _model_name(provider)
+
+    def _scope(self, session_memory, sentiment) -> str:
+        return self.cache.scope(self.name, self.model, context_hash(session_memory, sentiment))
+
+    def _answered_by_primary(self) -> bool:
+        # A hedge names its winner; the router names the provider it failed over to
+        name = getattr(self.provider, 'winner', None) or answered_by.get() or self.name
+        if name != self.name:
+            # Another model's reply, which this scope's later lookups shouldn't get
+            logger.debug(f"Not caching a reply from {name} under {self.name}")
+            return False
+        return True
+
+    async def generate_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> str:
+        scope = self._scope(session_memory, sentiment)
+        cached, embedding = await self.cache.get(scope, text)
+        if cached is not None:
+            return cached
+
+        answered_by.set(None)
+        response = await self.provider.generate_response(text, session_memory, sentiment)
+        if self._answered_by_primary():
+            await self.cache.put(scope, text, response, embedding)
+        return response
+
+    async def stream_response(
+        self,
+        text: str,
+        session_memory: Optional[List[Dict[str, Any]]] = None,
+        sentiment: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        scope = self._scope(session_memory, sentiment)
+        cached, embedding = await self.cache.get(scope, text)
+        if cached is not None:
+            yield cached
+            return
+
+        answered_by.set(None)
+        chunks = []
+        async for chunk in self.provider.stream_response(text, session_memory, sentiment):
+            chunks.append(chunk)
+            yield chunk
+        if self._answered_by_primary():
+            await self.cache.put(scope, text, ''.join(chunks), embedding)
+
+    async def analyze_image(self, image_base64: str) -> str:
+        return await self.provider.analyze_image(image_base64)
+
+def create_response_cache(embedder: Optional[Embedder] = None) -> ResponseCache:
+    """Build a response cache from the RESPONSE_CACHE_* environment variables."""
+    return ResponseCache(
+        ttl=float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+        max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000')),
+        max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+        embedder=embedder,
+        similarity_threshold=float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.95')),
+        embed_timeout=float(os.getenv('RESPONSE_CACHE_EMBED_TIMEOUT', '0.2'))
+    )
@@ -1,15 +1,72 @@
+import os
+import logging
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
 from textblob import TextBlob
 
+from sentiment_lexicon import CompiledLexicon
+
+logger = logging.getLogger(__name__)
+
+def label_for(polarity: float) -> str:
+    """Map a polarity score onto 'positive', 'negative' or 'neutral'."""
+    if polarity > 0.2:
+        return 'positive'
+    elif polarity < -0.2:
+        return 'negative'
+    else:
+        return 'neutral'
+
 def analyze_sentiment(text):
     """
     Analyze sentiment of input text
     Returns: 'positive', 'negative', or 'neutral'
     """
     sentiment = TextBlob(text).sentiment.polarity
-    
-    if sentiment > 0.2:
-        return 'positive'
-    elif sentiment < -0.2:
-        return 'negative'
-    else:
-        return 'neutral'
+    return label_for(sentiment)
+
+def score_text(text: str) -> Dict[str, Any]:
+    """
+    Full sentiment scores for input text
+    Returns: {'polarity', 'subjectivity', 'label'}
+    """
+    sentiment = TextBlob(text).sentiment
+    return {
+        "polarity": sentiment.polarity,
+        "subjectivity": sentiment.subjectivity,
+        "label": label_for(sentiment.polarity)
+    }
+
+@lru_cache(maxsize=None)
+def compiled_lexicon() -> Optional[CompiledLexicon]:
+    """This process's compiled lexicon, or None if batches are scored by TextBlob."""
+    if os.getenv('SENTIMENT_ENGINE', 'lexicon') != 'lexicon':
+        return None
+    try:
+        return CompiledLexicon()
+    except RuntimeError as e:
+        # numpy isn't installed; say so, as batches are much slower without it
+        logger.warning(f"{e}; scoring sentiment batches with TextBlob one text at a time")
+        return None
+
+def score_batch(texts: List[str]) -> List[Dict[str, Any]]:
+    """Score several texts in one call (one round-trip to a worker pool).
+
+    Scores and labels are the same as score_text() gives one by one.
+    """
+    lexicon = compiled_lexicon()
+    if lexicon is None:
+        return [score_text(text) for text in texts]
+    return [
+        {"polarity": polarity, "subjectivity": subjectivity, "label": label_for(polarity)}
+        for polarity, subjectivity in lexicon.score(texts)
+    ]
+
+def analyze_batch(texts: List[str]) -> List[str]:
+    """Labels for several texts, as analyze_sentiment() returns them."""
+    return [score['label'] for score in score_batch(texts)]
+
+def warm_up():
+    """Load the TextBlob lexicon so the first real request doesn't pay for it."""
+    TextBlob("warm up").sentiment
+    compiled_lexicon()
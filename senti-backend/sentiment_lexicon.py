@@ -0,0 +1,207 @@
+from typing import List, Dict, Tuple, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from textblob.en import sentiment as pattern_sentiment
+from textblob._text import (
+    PUNCTUATION,
+    ABBREVIATIONS,
+    RE_ABBR1,
+    RE_ABBR2,
+    RE_ABBR3,
+    RE_EMOTICONS,
+    replacements
+)
+
+# find_tokens splits periods separately from other punctuation
+_LEADING = tuple(PUNCTUATION.replace(".", ""))
+_TRAILING = _LEADING + (".",)
+
+Score = Tuple[float, float]
+
+def _is_abbreviation(token: str) -> bool:
+    return (
+        token in ABBREVIATIONS
+        or RE_ABBR1.match(token) is not None
+        or RE_ABBR2.match(token) is not None
+        or RE_ABBR3.match(token) is not None
+    )
+
+class CompiledLexicon:
+    """TextBlob's sentiment lexicon compiled into arrays for batch scoring.
+
+    Scores are identical to `TextBlob(text).sentiment`: the same lexicon
+    entries, tokenization and modifier/negation rules, without building a
+    TextBlob per text. Texts made only of plain lexicon words are averaged
+    for the whole batch at once; texts with modifiers ("very good") or
+    negations ("not good") go through a compiled port of pattern's
+    assessment loop. Texts that use anything else pattern scores
+    (exclamation marks, emoticons, non-ASCII text, paragraph breaks) are
+    handed to pattern's analyzer itself, which is what TextBlob calls
+    underneath.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("The compiled lexicon requires numpy")
+
+        lexicon = pattern_sentiment
+        len(lexicon)  # lazydict: loads the XML lexicon on first access
+
+        words = list(dict.keys(lexicon))
+        self.vocab: Dict[str, int] = {word: index for index, word in enumerate(words)}
+        entries = [dict.__getitem__(lexicon, word)[None] for word in words]
+        # Plain lists for the per-token loop, arrays for the batch reduction
+        self.polarity = [entry[0] for entry in entries]
+        self.subjectivity = [entry[1] for entry in entries]
+        self.intensity = [entry[2] for entry in entries]
+        self.modifies = [any(pos in dict.__getitem__(lexicon, word) for pos in lexicon.modifiers) for word in words]
+        self.polarity_array = np.array(self.polarity, dtype=np.float64)
+        self.subjectivity_array = np.array(self.subjectivity, dtype=np.float64)
+
+        self.negations = frozenset(lexicon.negations)
+        self.modifier = lexicon.modifier
+
+        self.batched = 0
+        self.sequential = 0
+        self.delegated = 0
+
+    def tokens(self, text: str) -> Optional[List[str]]:
+        """pattern's tokens for `text`, or None if it needs pattern's own analyzer."""
+        if not text.isascii() or '!' in text:
+            return None
+        text = text.replace('\r\n', '\n')
+        if '\n\n' in text:
+            return None
+
+        for old, new in replacements.items():
+            text = text.replace(old, new)
+        text = text.replace("'", " ' ").replace('"', ' " ')
+
+        tokens: List[str] = []
+        for chunk in text.split():
+            if chunk.isalnum():
+                tokens.append(chunk)
+                continue
+            tail = []
+            while chunk.startswith(_LEADING) and chunk not in replacements:
+                tokens.append(chunk[0])
+                chunk = chunk[1:]
+            while chunk.endswith(_TRAILING) and chunk not in replacements:
+                if chunk.endswith(_LEADING):
+                    tail.append(chunk[-1])
+                    chunk = chunk[:-1]
+                if chunk.endswith('...'):
+                    tail.append('...')
+                    chunk = chunk[:-3].rstrip('.')
+                if chunk.endswith('.'):
+                    if _is_abbreviation(chunk):
+                        break
+                    tail.append('.')
+                    chunk = chunk[:-1]
+            if chunk:
+                tokens.append(chunk)
+            tokens.extend(reversed(tail))
+
+        # pattern rejoins emoticons that tokenizing split apart
+        if RE_EMOTICONS.search(' '.join(tokens) + ' '):
+            return None
+        return [token.lower() for token in tokens]
+
+    def _assess(self, tokens: List[str], ids: List[int]) -> Score:
+        """pattern's Sentiment.assessments() and average, over compiled lookups."""
+        assessments = []  # [polarity, subjectivity, intensity, negated]
+        modifier = None
+        negation = None
+        for word, index in zip(tokens, ids):
+            if index >= 0:
+                polarity, subjectivity, intensity = (
+                    self.polarity[index], self.subjectivity[index], self.intensity[index]
+                )
+                if modifier is None:
+                    assessments.append([polarity, subjectivity, intensity, 1])
+                else:
+                    # "really good": scale by the modifier's intensity
+                    last = assessments[-1]
+                    last[0] = max(-1.0, min(polarity * last[2], +1.0))
+                    last[1] = max(-1.0, min(subjectivity * last[2], +1.0))
+                    last[2] = intensity
+                if negation is not None:
+                    assessments[-1][2] = 1.0 / assessments[-1][2]
+                    assessments[-1][3] = -1
+                modifier = word if self.modifies[index] else None
+                negation = word if word in self.negations else None
+            else:
+                if word in self.negations:
+                    negation = word
+                # Negations carry across small words ("not a good")
+                elif negation and len(word.strip("'")) > 1:
+                    negation = None
+                # "really not good"
+                if negation is not None and modifier is not None and self.modifier(modifier):
+                    assessments[-1][3] = -1
+                    negation = None
+                # Modifiers carry across small words ("really is a good")
+                elif modifier and len(word) > 2:
+                    modifier = None
+
+        if not assessments:
+            return 0.0, 0.0
+        polarity = 0
+        subjectivity = 0
+        for p, s, _, negated in assessments:
+            # "not good" = slightly bad, "not bad" = slightly good
+            polarity += p * -0.5 if negated < 0 else p
+            subjectivity += s
+        return polarity / float(len(assessments)), subjectivity / float(len(assessments))
+
+    def score(self, texts: List[str]) -> List[Score]:
+        """(polarity, subjectivity) for every text, in order."""
+        scores: List[Optional[Score]] = [None] * len(texts)
+        batched: List[int] = []
+        docs: List[int] = []
+        flat_ids: List[int] = []
+
+        for position, text in enumerate(texts):
+            tokens = self.tokens(text)
+            if tokens is None:
+                sentiment = pattern_sentiment(text)
+                scores[position] = (sentiment[0], sentiment[1])
+                self.delegated += 1
+                continue
+
+            ids = [self.vocab.get(token, -1) for token in tokens]
+            if any(token in self.negations for token in tokens) or any(
+                index >= 0 and self.modifies[index] for index in ids
+            ):
+                scores[position] = self._assess(tokens, ids)
+                self.sequential += 1
+            else:
+                batched.append(position)
+                docs.extend([position] * len(ids))
+                flat_ids.extend(ids)
+
+        if batched:
+            # Plain texts: each score is the mean over its known words
+            ids = np.array(flat_ids, dtype=np.int64)
+            known = ids >= 0
+            doc_index = np.array(docs, dtype=np.int64)[known]
+            ids = ids[known]
+            counts = np.bincount(doc_index, minlength=len(texts))
+            polarity = np.bincount(doc_index, weights=self.polarity_array[ids], minlength=len(texts))
+            subjectivity = np.bincount(doc_index, weights=self.subjectivity_array[ids], minlength=len(texts))
+            for position in batched:
+                n = float(counts[position] or 1)
+                scores[position] = (float(polarity[position]) / n, float(subjectivity[position]) / n)
+            self.batched += len(batched)
+        return scores
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "batched": self.batched,
+            "sequential": self.sequential,
+            "delegated": self.delegated
+        }
@@ -0,0 +1,98 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from sentiment_analyzer import score_batch, warm_up
+
+logger = logging.getLogger(__name__)
+
+class SentimentService:
+    """Memoized sentiment scoring that runs off the event loop."""
+
+    def __init__(self, executor_type: Optional[str] = None, max_workers: Optional[int] = None):
+        self.executor_type = executor_type or os.getenv('SENTIMENT_EXECUTOR', 'process')
+        self.max_workers = max_workers or int(os.getenv('SENTIMENT_WORKERS', '2'))
+        self.cache_size = int(os.getenv('SENTIMENT_CACHE_SIZE', '10000'))
+
+        self._executor: Optional[Executor] = None
+        self._cache: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self):
+        """Start the worker pool and warm up the analyzer in every worker."""
+        executor = self.executor
+        loop = asyncio.get_running_loop()
+        # Forces the workers to spawn now rather than on the first message
+        await asyncio.gather(*[
+            loop.run_in_executor(executor, warm_up) for _ in range(self.max_workers)
+        ])
+        logger.info(f"Sentiment service started ({self.executor_type}, workers={self.max_workers})")
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=warm_up
+                )
+        return self._executor
+
+    async def analyze(self, text: str) -> Dict[str, Any]:
+        """Polarity, subjectivity and label for a single text."""
+        return (await self.analyze_batch([text]))[0]
+
+    async def analyze_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Score many texts, sending only uncached ones to the worker pool."""
+        results: Dict[str, Dict[str, Any]] = {}
+        pending: List[str] = []
+        seen = set()
+        for text in texts:
+            if text in seen:
+                continue
+            seen.add(text)
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                results[text] = cached
+                self.hits += 1
+            else:
+                pending.append(text)
+                self.misses += 1
+
+        if pending:
+            loop = asyncio.get_running_loop()
+            scores = await loop.run_in_executor(self.executor, score_batch, pending)
+            for text, score in zip(pending, scores):
+                results[text] = score
+                self._remember(text, score)
+
+        # Hand out copies so callers can't corrupt the cache
+        return [dict(results[text]) for text in texts]
+
+    def _remember(self, text: str, score: Dict[str, Any]):
+        self._cache[text] = score
+        self._cache.move_to_end(text)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+# Shared instance used by the websocket handlers
+sentiment_service = SentimentService()
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+Turn = Dict[str, Any]
+Summarizer = Callable[[List[Turn]], Awaitable[str]]
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+class SessionBackend(ABC):
+    @abstractmethod
+    async def load(self, session_id: str) -> List[Turn]:
+        pass
+
+    @abstractmethod
+    async def save(self, session_id: str, turns: List[Turn]):
+        pass
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        pass
+
+class MemorySessionBackend(SessionBackend):
+    """In-process LRU of session histories."""
+
+    def __init__(self, max_sessions: int = 1000):
+        self.max_sessions = max_sessions
+        self._sessions: 'OrderedDict[str, List[Turn]]' = OrderedDict()
+
+    async def load(self, session_id: str) -> List[Turn]:
+        turns = self._sessions.get(session_id)
+        if turns is None:
+            return []
+        self._sessions.move_to_end(session_id)
+        return list(turns)
+
+    async def save(self, session_id: str, turns: List[Turn]):
+        self._sessions[session_id] = list(turns)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+class SQLiteSessionBackend(SessionBackend):
+    """Session histories persisted to a local SQLite file."""
+
+    def __init__(self, path: str = 'sessions.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'session_id TEXT PRIMARY KEY, turns TEXT NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def _load(self, session_id: str) -> List[Turn]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT turns FROM sessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _save(self, session_id: str, turns: List[Turn]):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, turns, updated_at) VALUES (?, ?, ?)',
+                (session_id, json.dumps(turns), time.time())
+            )
+            self._conn.commit()
+
+    def _delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            self._conn.commit()
+
+    # Disk I/O runs in a worker thread so it never blocks the event loop
+    async def load(self, session_id: str) -> List[Turn]:
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def save(self, session_id: str, turns: List[Turn]):
+        await asyncio.to_thread(self._save, session_id, turns)
+
+    async def delete(self, session_id: str):
+        await asyncio.to_thread(self._delete, session_id)
+
+class RedisSessionBackend(SessionBackend):
+    """Session histories in a Redis-compatible server, shared by all workers."""
+
+    def __init__(
+        self,
+        url: str = 'redis://localhost:6379/0',
+        ttl: Optional[int] = 86400,
+        client=None,
+        prefix: str = 'senti'
+    ):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("SESSION_BACKEND=redis requires the redis package")
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, session_id: str) -> str:
+        return f'{self.prefix}:session:{session_id}'
+
+    async def load(self, session_id: str) -> List[Turn]:
+        data = await self.client.get(self._key(session_id))
+        return json.loads(data) if data else []
+
+    async def save(self, session_id: str, turns: List[Turn]):
+        # Idle sessions expire instead of accumulating forever
+        await self.client.set(self._key(session_id), json.dumps(turns), ex=self.ttl)
+
+    async def delete(self, session_id: str):
+        await self.client.delete(self._key(session_id))
+
+class SessionStore:
+    """Per-connection conversation history bounded to a token budget."""
+
+    def __init__(
+        self,
+        backend: SessionBackend,
+        max_tokens: int = 2000,
+        summarizer: Optional[Summarizer] = None,
+        token_counter: Callable[[str], int] = estimate_tokens,
+        trim_ratio: float = 0.75
+    ):
+        self.backend = backend
+        self.max_tokens = max_tokens
+        self.trim_ratio = trim_ratio
+        self.summarizer = summarizer
+        self.token_counter = token_counter
+        self._sessions: Dict[str, str] = {}
+        # Per-session locks, dropped once no turn holds or awaits them
+        self._locks: 'weakref.WeakValueDictionary[str, asyncio.Lock]' = weakref.WeakValueDictionary()
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    def open(self, connection_id: str, session_id: Optional[str] = None) -> str:
+        """Bind a connection to a session, resuming `session_id` if given."""
+        session_id = session_id or uuid.uuid4().hex
+        self._sessions[connection_id] = session_id
+        return session_id
+
+    def close(self, connection_id: str):
+        """Forget the connection; the session itself stays resumable."""
+        self._sessions.pop(connection_id, None)
+
+    def session_id(self, connection_id: str) -> str:
+        return self._sessions.get(connection_id) or self.open(connection_id)
+
+    async def history(self, connection_id: str) -> List[Turn]:
+        """Current history window for a connection."""
+        return await self.backend.load(self.session_id(connection_id))
+
+    async def add_turns(self, connection_id: str, *turns: Turn):
+        """Append turns and trim the window back under the token budget."""
+        session_id = self.session_id(connection_id)
+        # Load-modify-save awaits the backend; concurrent turns of the same
+        # session would otherwise overwrite each other's history
+        async with self._lock(session_id):
+            history = await self.backend.load(session_id)
+            history.extend(turns)
+            history = await self._truncate(history)
+            await self.backend.save(session_id, history)
+
+    async def clear(self, connection_id: str):
+        session_id = self.session_id(connection_id)
+        async with self._lock(session_id):
+            await self.backend.delete(session_id)
+
+    async def _truncate(self, history: List[Turn]) -> List[Turn]:
+        total = sum(self.token_counter(t.get('content', '')) for t in history)
+        if total <= self.max_tokens:
+            return history
+
+        # Drop the oldest turns until the window is well under the budget, so
+        # the history's start (and the prompt prefix upstream caches key on)
+        # stays the same for the next several turns
+        target = int(self.max_tokens * self.trim_ratio)
+        dropped = []
+        while len(history) > 1 and total > target:
+            turn = history.pop(0)
+            total -= self.token_counter(turn.get('content', ''))
+            dropped.append(turn)
+
+        if self.summarizer is None:
+            return history
+
+        try:
+            summary = await self.summarizer(dropped)
+        except Exception as e:
+            logger.error(f"Session summarization error: {str(e)}")
+            return history
+
+        summary_turn = {
+            "role": "system",
+            "content": f"Summary of earlier conversation: {summary}"
+        }
+        # Make room for the summary itself, never dropping the newest turn
+        total += self.token_counter(summary_turn['content'])
+        while len(history) > 1 and total > self.max_tokens:
+            total -= self.token_counter(history.pop(0).get('content', ''))
+        return [summary_turn] + history
+
+def create_session_store(summarizer: Optional[Summarizer] = None) -> SessionStore:
+    """Build a session store from the SESSION_* environment variables."""
+    backend_name = os.getenv('SESSION_BACKEND', 'memory')
+    if backend_name == 'sqlite':
+        backend: SessionBackend = SQLiteSessionBackend(os.getenv('SESSION_DB_PATH', 'sessions.db'))
+    elif backend_name == 'redis':
+        backend = RedisSessionBackend(
+            os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            ttl=int(os.getenv('SESSION_TTL', '86400')) or None
+        )
+    else:
+        backend = MemorySessionBackend(int(os.getenv('SESSION_MAX_SESSIONS', '1000')))
+
+    return SessionStore(
+        backend,
+        max_tokens=int(os.getenv('SESSION_TOKEN_BUDGET', '2000')),
+        summarizer=summarizer,
+        trim_ratio=float(os.getenv('SESSION_TRIM_RATIO', '0.75'))
+    )
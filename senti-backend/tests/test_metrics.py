@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+parser = pytest.importorskip('prometheus_client.parser')
+
+def test_metrics_families_are_typed():
+    os.environ.setdefault('SENTIMENT_EXECUTOR', 'thread')
+    from fastapi.testclient import TestClient
+
+    import gateway
+    from metrics import registry, Counter, Gauge, Histogram, OUTBOUND_FRAMES, PROVIDER_CALL_SECONDS
+
+    # Samples only appear once a label set has been used
+    OUTBOUND_FRAMES.inc(outcome='sent')
+    PROVIDER_CALL_SECONDS.observe(0.2, provider='gemini', method='generate_response', outcome='ok')
+
+    with TestClient(gateway.app) as client:
+        response = client.get('/metrics')
+    assert response.status_code == 200
+
+    families = {family.name: family for family in parser.text_string_to_metric_families(response.text)}
+    kinds = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}
+    expected = {name: kinds[type(metric)] for name, metric in registry._metrics.items()}
+    assert {name: family.type for name, family in families.items()} == expected
+
+    sent = families['senti_outbound_frames']
+    assert [sample.name for sample in sent.samples] == ['senti_outbound_frames_total']
+    assert families['senti_provider_call_seconds'].samples
@@ -0,0 +1,36 @@
+import asyncio
+
+from outbound import OutboundQueue
+
+class StalledSocket:
+    """Holds every send until `release` is set, like a client that stopped reading."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.sent = []
+
+    async def send_json(self, data):
+        await self.release.wait()
+        self.sent.append(data)
+
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(text)
+
+def test_drop_policy_delivers_busy_after_flood():
+    async def scenario():
+        socket = StalledSocket()
+        queue = OutboundQueue(socket, max_frames=4, policy='drop')
+        for turn in range(20):
+            await queue.send_json({"type": "stream", "content": "x", "turn_id": f"t{turn}"})
+        await queue.send_json({"type": "busy", "reason": "rate_limited", "retry_after": 1.0, "turn_id": "late"})
+
+        socket.release.set()
+        while queue.depth:
+            await asyncio.sleep(0)
+        await queue.stop()
+        return socket.sent
+
+    sent = asyncio.run(scenario())
+    assert OutboundQueue.dropped > 0
+    assert {"type": "busy", "reason": "rate_limited", "retry_after": 1.0, "turn_id": "late"} in sent
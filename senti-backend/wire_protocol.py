@@ -0,0 +1,99 @@
+import json
+from typing import Dict, Any, Optional
+
+import msgpack
+from fastapi import WebSocket, WebSocketDisconnect
+
+from metrics import FRAME_DECODE_SECONDS, FRAME_ENCODE_SECONDS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Websocket subprotocols a client can offer, most compact first
+MSGPACK_PROTOCOL = 'senti.msgpack'
+JSON_PROTOCOL = 'senti.json'
+SUPPORTED_PROTOCOLS = [MSGPACK_PROTOCOL, JSON_PROTOCOL]
+
+class ProtocolError(ValueError):
+    """Raised when a frame can't be decoded."""
+
+def _dumps_json(data: Dict[str, Any]) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode('utf-8')
+    return json.dumps(data)
+
+def _loads_json(text: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def negotiate_subprotocol(websocket: WebSocket) -> Optional[str]:
+    """Pick the wire format from the offered subprotocols or `?encoding=`.
+
+    The result selects the frame encoding; it is only sent back in the
+    handshake if the client actually offered it.
+    """
+    offered = websocket.scope.get('subprotocols', [])
+    for protocol in SUPPORTED_PROTOCOLS:
+        if protocol in offered:
+            return protocol
+
+    # Some clients can't set subprotocols, so a query parameter also works
+    if websocket.query_params.get('encoding') == 'msgpack':
+        return MSGPACK_PROTOCOL
+    return None
+
+class WireSocket:
+    """WebSocket wrapper speaking either JSON text frames or MessagePack binary frames.
+
+    Incoming frames are decoded by frame type, so a JSON client may still
+    send binary MessagePack frames (e.g. raw image bytes without base64).
+    Everything else is delegated to the wrapped WebSocket.
+    """
+
+    def __init__(self, websocket: WebSocket, subprotocol: Optional[str] = None):
+        self.websocket = websocket
+        self.subprotocol = subprotocol
+        self.binary = subprotocol == MSGPACK_PROTOCOL
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.websocket, name)
+
+    def encode(self, data: Dict[str, Any]) -> Any:
+        if self.binary:
+            with FRAME_ENCODE_SECONDS.time(format='msgpack'):
+                return msgpack.packb(data, use_bin_type=True)
+        with FRAME_ENCODE_SECONDS.time(format='json'):
+            return _dumps_json(data)
+
+    def decode(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            if message.get('bytes') is not None:
+                with FRAME_DECODE_SECONDS.time(format='msgpack'):
+                    data = msgpack.unpackb(message['bytes'], raw=False)
+            else:
+                with FRAME_DECODE_SECONDS.time(format='json'):
+                    data = _loads_json(message['text'])
+        except (ValueError, TypeError) as e:
+            # json, orjson and msgpack decode errors are ValueErrors; msgpack
+            # raises TypeError for maps with unhashable keys
+            raise ProtocolError(f"Invalid frame: {str(e)}")
+
+        if not isinstance(data, dict):
+            raise ProtocolError("Frames must be objects")
+        return data
+
+    async def receive_json(self) -> Dict[str, Any]:
+        message = await self.websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            raise WebSocketDisconnect(message.get('code', 1000))
+        return self.decode(message)
+
+    async def send_json(self, data: Dict[str, Any]):
+        payload = self.encode(data)
+        if self.binary:
+            await self.websocket.send_bytes(payload)
+        else:
+            await self.websocket.send_text(payload)